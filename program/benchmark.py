@@ -0,0 +1,234 @@
+import argparse
+import csv
+import json
+import platform
+import statistics
+import subprocess
+
+import myinstances as data
+from solver import *
+from positionsolver import PositionSolver
+from lovsolver import LOVSolver
+from tivsolver import TIVSolver
+from heuristic import HeuristicSolver
+
+benchmark_solvers = {'piv': PositionSolver, 'lov': LOVSolver, 'tiv': TIVSolver, 'heuristic': HeuristicSolver}
+
+# Columns of a benchmark row, the key of a cell first
+key_columns = ['dataset', 'configuration', 'instance', 'formulation']
+columns = key_columns + ['repetition', 'status', 'makespan', 'bound', 'gap', 'build_time', 'relax_time', 'solve_time',
+                         'work', 'nodes', 'peak_rss', 'vars', 'constrs', 'nonzeros', 'error']
+# Metrics that are compared against the baseline, the medians over the repetitions of a cell
+compared = ['build_time', 'solve_time', 'work', 'peak_rss']
+
+
+@dataclass
+class Settings:
+    seed: int = 0
+    threads: int = 1
+    time_limit: float = 600
+    repetitions: int = 3
+    relaxed: bool = False
+
+    # Gurobi parameters that pin the solve down, so that work units and node counts are reproducible
+    def params(self):
+        return {"OutputFlag": 0, "Seed": self.seed, "Threads": self.threads, "TimeLimit": self.time_limit}
+
+
+# Versions and machine of a benchmark, runs are only comparable on the same machine
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'gurobi': ".".join(map(str, gp.gurobi.version())),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.node(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+
+# The (dataset, configuration, instance) cells of a benchmark; configurations and instances are 1-based like in the
+# dataset files, None selects all of them
+def benchmark_cells(names, configurations=None, instances=None):
+    cells = []
+    for name in names:
+        if name not in data.datasets:
+            raise Exception(f"Unknown dataset {name}, expected one of {', '.join(data.datasets)}")
+        instance_sets = data.datasets[name]
+        for c in configurations or range(1, len(instance_sets) + 1):
+            if not 1 <= c <= len(instance_sets):
+                raise Exception(f"Dataset {name} has no configuration {c}")
+            for i in instances or range(1, len(instance_sets[c - 1].instances) + 1):
+                cells.append((name, c, i))
+    return cells
+
+
+# Solve one instance with one formulation and measure it
+def measure(solver: Solver, instance: Instance, settings: Settings):
+    row = dict.fromkeys(columns[len(key_columns) + 1:])
+    try:
+        solver.solve(instance, relaxed=settings.relaxed)
+        solution = solver.solution
+        # None when the MIP was not solved to optimality, the record below still has its state
+        if solution is not None:
+            row.update(makespan=solution.makespan, bound=solution.bound, solve_time=solution.solve_time)
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    profile = solver.get_profile()
+    row.update(build_time=solver.build_time, relax_time=solver.relax_time,
+               peak_rss=max((rss for _, rss in profile.phases.values() if rss is not None), default=None),
+               vars=profile.model.get('vars'), constrs=profile.model.get('constrs'),
+               nonzeros=profile.model.get('nonzeros'))
+    if solver.record is not None:
+        record = solver.record
+        row.update(status=record.status, gap=record.gap, work=record.work, nodes=record.nodes)
+        # Runtime of the MIP solve alone, solution.solve_time counts work units
+        row['solve_time'] = solver.get_model().Runtime
+    return row
+
+
+def run_benchmark(cells, formulations, settings: Settings, log=print):
+    rows = []
+    for name, c, i in cells:
+        instance = data.datasets[name][c - 1].instances[i - 1]
+        for formulation in formulations:
+            solver = benchmark_solvers[formulation]()
+            solver.params = settings.params()
+            for repetition in range(settings.repetitions):
+                row = {'dataset': name, 'configuration': c, 'instance': i, 'formulation': formulation,
+                       'repetition': repetition, **measure(solver, instance, settings)}
+                log(f"{name} {c}_{i} {formulation} #{repetition}: " +
+                    (row['error'] or f"status {row['status']}, makespan {row['makespan']}, "
+                                     f"build {row['build_time'] or 0:.3f} s, solve {row['solve_time'] or 0:.3f} s, "
+                                     f"work {row['work']}"))
+                rows.append(row)
+    return rows
+
+
+def write_benchmark(path, settings: Settings, formulations, rows):
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        return
+    with open(path, "w") as f:
+        json.dump({'settings': settings.__dict__, 'formulations': formulations, 'environment': environment(),
+                   'rows': rows}, f, indent=1)
+
+
+def read_rows(path):
+    if not path.endswith(".csv"):
+        with open(path) as f:
+            return json.load(f)['rows']
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    # CSV stores everything as text, empty for None
+    for row in rows:
+        for column in columns:
+            if column in ('dataset', 'formulation', 'error'):
+                row[column] = row[column] or None
+            elif row[column] == '':
+                row[column] = None
+            else:
+                row[column] = float(row[column])
+                if row[column].is_integer() and column in ('configuration', 'instance', 'repetition', 'status'):
+                    row[column] = int(row[column])
+    return rows
+
+
+# Median of every compared metric and the outcome of each cell, over its repetitions
+def summarize(rows):
+    cells = {}
+    for row in rows:
+        cells.setdefault(tuple(row[c] for c in key_columns), []).append(row)
+    summary = {}
+    for key, reps in cells.items():
+        summary[key] = {metric: statistics.median(values) if (values := [r[metric] for r in reps
+                                                                         if r[metric] is not None]) else None
+                        for metric in compared}
+        summary[key].update(makespan=reps[0]['makespan'], status=reps[0]['status'],
+                            error=next((r['error'] for r in reps if r['error']), None))
+    return summary
+
+
+# Cells that got worse than in the baseline: a metric more than tolerance slower (and by more than the noise floor of
+# that metric), a new error, another status or another makespan. Returns (key, what, baseline, current) tuples.
+def compare(baseline, current, tolerance=0.1, floors=None):
+    floors = {'build_time': 0.05, 'solve_time': 0.05, 'work': 0.01, 'peak_rss': 10, **(floors or {})}
+    base = summarize(baseline)
+    regressions = []
+    for key, cell in summarize(current).items():
+        if key not in base:
+            continue
+        old = base[key]
+        if cell['error'] is not None and old['error'] is None:
+            regressions.append((key, 'error', None, cell['error']))
+            continue
+        if cell['status'] != old['status']:
+            regressions.append((key, 'status', old['status'], cell['status']))
+        if cell['makespan'] is not None and old['makespan'] is not None and \
+                abs(cell['makespan'] - old['makespan']) > delta:
+            regressions.append((key, 'makespan', old['makespan'], cell['makespan']))
+        for metric in compared:
+            if cell[metric] is None or old[metric] is None:
+                continue
+            if cell[metric] > old[metric] * (1 + tolerance) and cell[metric] - old[metric] > floors[metric]:
+                regressions.append((key, metric, old[metric], cell[metric]))
+    return regressions
+
+
+# Ratio of the total of every compared metric over the cells both benchmarks have, per formulation
+def speedups(baseline, current):
+    base = summarize(baseline)
+    totals = {}
+    for key, cell in summarize(current).items():
+        if key not in base:
+            continue
+        for metric in compared:
+            if cell[metric] is not None and base[key][metric] is not None:
+                old, new = totals.setdefault((key[3], metric), [0, 0])
+                totals[key[3], metric] = [old + base[key][metric], new + cell[metric]]
+    return {key: old / new if new > 0 else float('inf') for key, (old, new) in totals.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the formulations and compare against a baseline")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help="Benchmark formulations on selected instances")
+    run.add_argument('--datasets', nargs='+', default=list(data.datasets))
+    run.add_argument('--configurations', type=int, nargs='+', help="1-based, all by default")
+    run.add_argument('--instances', type=int, nargs='+', default=[1], help="1-based")
+    run.add_argument('--formulations', nargs='+', choices=list(benchmark_solvers), default=['piv', 'lov', 'tiv'])
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--threads', type=int, default=1)
+    run.add_argument('--time-limit', type=float, default=600)
+    run.add_argument('--repetitions', type=int, default=3)
+    run.add_argument('--relaxed', action='store_true', help="Also solve the LP relaxations")
+    run.add_argument('--out', default="benchmark.json", help="Results file, CSV if it ends in .csv and else JSON")
+    diff = subparsers.add_parser('compare', help="Report the regressions of a benchmark against a baseline")
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    diff.add_argument('--tolerance', type=float, default=0.1, help="Relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        settings = Settings(seed=args.seed, threads=args.threads, time_limit=args.time_limit,
+                            repetitions=args.repetitions, relaxed=args.relaxed)
+        cells = benchmark_cells(args.datasets, args.configurations, args.instances)
+        rows = run_benchmark(cells, args.formulations, settings)
+        write_benchmark(args.out, settings, args.formulations, rows)
+        print(f"Wrote {len(rows)} runs to {args.out}")
+    else:
+        baseline, current = read_rows(args.baseline), read_rows(args.current)
+        for (formulation, metric), ratio in sorted(speedups(baseline, current).items()):
+            print(f"{formulation:10} {metric:12} {ratio:.3f}x")
+        regressions = compare(baseline, current, args.tolerance)
+        for (name, c, i, formulation), what, old, new in regressions:
+            print(f"REGRESSION {name} {c}_{i} {formulation}: {what} {old} -> {new}")
+        print(f"{len(regressions)} regressions")
+        sys.exit(1 if regressions else 0)
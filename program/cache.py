@@ -0,0 +1,102 @@
+import json
+
+from sqlalchemy import create_engine, delete, event, func, inspect, select, update
+from sqlalchemy import Column, Integer, String, Float, Boolean, LargeBinary
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.declarative import declarative_base
+
+from solver import *
+from database import pack_solution, unpack_solution, set_sqlite_pragmas
+
+CacheModel = declarative_base(name='CacheModel')
+
+
+# Optimal solutions by instance digest, formulation, relaxation and Gurobi parameters
+class CachedSolutions(CacheModel):
+    __tablename__ = 'cached_solutions'
+    digest = Column(String, primary_key=True)
+    formulation = Column(String, primary_key=True)
+    relaxed = Column(Boolean, primary_key=True)
+    params = Column(String, primary_key=True)
+    options = Column(String, primary_key=True)
+    makespan = Column(Float)
+    bound = Column(Float)
+    solve_time = Column(Float)
+    method = Column(String)
+    server_order = Column(LargeBinary)
+    start_times = Column(LargeBinary)
+    size = Column(Integer)
+    last_used = Column(Float, index=True)
+
+
+key_columns = ['digest', 'formulation', 'relaxed', 'params', 'options']
+
+
+class SolutionCache:
+    """
+    On-disk cache of optimal solutions in front of Solver.solve, enabled with solver.cache = SolutionCache().
+
+    Solutions are keyed by the formulation, its construction options (Solver.options) and its Gurobi parameters, so
+    variants of a formulation do not share them. Instances are identified by Instance.digest, so a solution is found
+    again when the instance is loaded anew. Once the stored solutions take more than max_bytes, the least recently
+    used ones are evicted.
+    """
+
+    def __init__(self, path='../db/cache.db', max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 60})
+        event.listen(self.engine, 'connect', set_sqlite_pragmas)
+        # Caches written before the options were part of the key cannot tell the variants apart, so they are dropped
+        table = CachedSolutions.__table__
+        if inspect(self.engine).has_table(table.name) and \
+                'options' not in {c['name'] for c in inspect(self.engine).get_columns(table.name)}:
+            table.drop(self.engine)
+        CacheModel.metadata.create_all(self.engine)
+
+    @staticmethod
+    def key(solver: Solver, instance: Instance, relaxed):
+        return dict(digest=instance.digest(), formulation=solver.name, relaxed=relaxed,
+                    params=json.dumps(solver.params, sort_keys=True),
+                    options=json.dumps(solver.options(), sort_keys=True))
+
+    def get(self, solver: Solver, instance: Instance, relaxed) -> Solution:
+        key = self.key(solver, instance, relaxed)
+        where = [getattr(CachedSolutions, c) == key[c] for c in key_columns]
+        with self.engine.begin() as conn:
+            row = conn.execute(select(CachedSolutions.__table__).where(*where)).first()
+            if row is None:
+                return None
+            conn.execute(update(CachedSolutions).where(*where).values(last_used=time.time()))
+        solution = unpack_solution(row, instance)
+        solution.solve_time = row.solve_time
+        solution.bound = row.bound
+        return solution
+
+    def put(self, solver: Solver, instance: Instance, relaxed, solution: Solution):
+        row = {
+            **self.key(solver, instance, relaxed),
+            **pack_solution(solution, relaxed),
+            'bound': solution.bound,
+            'solve_time': solution.solve_time,
+            'method': solution.method,
+            'last_used': time.time()
+        }
+        row['size'] = len(row['server_order']) + len(row['start_times'])
+        with self.engine.begin() as conn:
+            stmt = insert(CachedSolutions)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=key_columns,
+                set_={c: stmt.excluded[c] for c in row if c not in key_columns}
+            ), row)
+            self.evict(conn)
+
+    def evict(self, conn):
+        total = conn.execute(select(func.sum(CachedSolutions.size))).scalar() or 0
+        if total <= self.max_bytes:
+            return
+        columns = [getattr(CachedSolutions, c) for c in key_columns]
+        for row in conn.execute(select(*columns, CachedSolutions.size).order_by(CachedSolutions.last_used)).all():
+            conn.execute(delete(CachedSolutions).where(*[c == v for c, v in zip(columns, row)]))
+            total -= row.size
+            if total <= self.max_bytes:
+                return
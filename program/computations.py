@@ -1,111 +1,470 @@
-from sqlalchemy import create_engine, Column, Date, ForeignKey, Integer, String, Float
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+from threading import Thread, Event
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
 
 import myinstances as data
+import database as db
+from database import Results, Attempts, Jobs, ResultsWriter, pack_solution, pack_record
+from cache import SolutionCache
 
 from program.solver import *
 from program.positionsolver import PositionSolver
 from program.lovsolver import LOVSolver
 from program.tivsolver import TIVSolver
-
-engine = create_engine('sqlite:///../db/results.db', echo=True)
-
-Model = declarative_base(name='Model')
-
-
-class Results(Model):
-    __tablename__ = 'results'
-    configuration = Column(Integer, primary_key=True)
-    instance = Column(Integer, primary_key=True)
-    dataset = Column(String, primary_key=True)
-    # PIV
-    makespan_piv = Column(Float)
-    runtime_piv = Column(Float)
-    # PIV Relaxation
-    makespan_piv_r = Column(Float)
-    runtime_piv_r = Column(Float)
-    # LOV
-    makespan_lov = Column(Float)
-    runtime_lov = Column(Float)
-    # LOV Relaxation
-    makespan_lov_r = Column(Float)
-    runtime_lov_r = Column(Float)
-    # TIV
-    makespan_tiv = Column(Float)
-    runtime_tiv = Column(Float)
-    method_tiv = Column(String)
-    # TIV Relaxation
-    makespan_tiv_r = Column(Float)
-    runtime_tiv_r = Column(Float)
-    method_tiv_r = Column(String)
-    # Heuristic Value
-    makespan_heuristic = Column(Float)
-    runtime_heuristic = Column(Float)
-    # Max total machine time
-    max_tot_machine_time = Column(Float)
-
-
-Model.metadata.create_all(engine)
-
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+from program.heuristic import HeuristicSolver
+from program.portfolio import PortfolioSolver
+from program.selector import AutoSolver, Selector
 
 piv_solver = PositionSolver()
 lov_solver = LOVSolver()
 tiv_solver = TIVSolver()
+heuristic_solver = HeuristicSolver()
+portfolio_solver = PortfolioSolver()
+auto_solver = AutoSolver()
+
+
+solvers = {'piv': piv_solver, 'lov': lov_solver, 'tiv': tiv_solver, 'heuristic': heuristic_solver,
+           'portfolio': portfolio_solver, 'auto': auto_solver}
+# Methods of a campaign: every formulation timed on its own, and the heuristic.
+# The portfolio races the formulations and only records the fastest proof, auto solves with the formulation the
+# selector predicts to be fastest.
+methods = ['piv', 'lov', 'tiv', 'heuristic']
+# Methods that also solve their LP relaxation
+formulations = ['piv', 'lov', 'tiv']
+
+
+# Settings from the environment, so that worker processes share them: solutions of earlier campaigns are reused when
+# SOLUTION_CACHE names a cache database, SHARED_RELAXATION=1 solves the relaxations on the MIP models themselves,
+# PROFILE_PYTHON=1 runs cProfile during the Python side phases and CHECK_SOLUTIONS=1 verifies every solution.
+# RECORD_INTERVAL gives the seconds between the trajectory points recorded during every MIP solve.
+# SELECTOR names the runtime models of the auto method and MEMORY_BUDGET the MB its models may take.
+def configure_solvers(solvers):
+    if 'auto' in solvers:
+        selector = solvers['auto'].selector
+        budget = float(os.environ['MEMORY_BUDGET']) if os.environ.get('MEMORY_BUDGET') else None
+        if os.environ.get('SELECTOR'):
+            selector = Selector.load(os.environ['SELECTOR'], selector.solvers)
+        selector.memory_budget = budget
+        solvers['auto'].selector = selector
+    cache = SolutionCache(os.environ['SOLUTION_CACHE']) if os.environ.get('SOLUTION_CACHE') else None
+    for solver in solvers.values():
+        solver.cache = cache
+        solver.shared_relaxation = os.environ.get('SHARED_RELAXATION', '0') == '1'
+        solver.profile_python = os.environ.get('PROFILE_PYTHON', '0') == '1'
+        solver.check_solutions = os.environ.get('CHECK_SOLUTIONS', '0') == '1'
+        solver.record_interval = float(os.environ['RECORD_INTERVAL']) if os.environ.get('RECORD_INTERVAL') else None
+
+
+configure_solvers(solvers)
+
+
+def max_machine_time(inst):
+    return inst.arrays.work.max(initial=0).item()
+
+
+# Solve one instance with one method and collect the values of its Results columns
+def method_results(inst, method, solver):
+    solver.solve(inst)
+    results = dict(max_tot_machine_time=max_machine_time(inst))
+    if method not in formulations:
+        results[f'makespan_{method}'] = solver.get_solution(relaxed=False).makespan
+        results[f'runtime_{method}'] = solver.get_solution(relaxed=False).solve_time
+        if method in ('portfolio', 'auto'):
+            results[f'method_{method}'] = solver.get_solution(relaxed=False).method
+        return results
+
+    results[f'makespan_{method}'] = solver.get_solution(relaxed=False).makespan
+    results[f'runtime_{method}'] = solver.get_solution(relaxed=False).solve_time
+    results[f'makespan_{method}_r'] = solver.get_solution(relaxed=True).makespan
+    results[f'runtime_{method}_r'] = solver.get_solution(relaxed=True).solve_time
+    if method in ('piv', 'tiv'):
+        results[f'method_{method}'] = solver.get_solution(relaxed=False).method
+        results[f'method_{method}_r'] = solver.get_solution(relaxed=True).method
+    return results
+
+
+# Solve one instance with every solver and collect the values of its Results row
+def instance_results(inst, solvers):
+    results = {}
+    for method in methods:
+        results.update(method_results(inst, method, solvers[method]))
+    return results
+
+
+# Packed solutions of the last solve of a method
+def solution_rows(method, solver):
+    rows = [pack_solution(solver.get_solution(relaxed=False), False)]
+    if method in formulations:
+        rows.append(pack_solution(solver.get_solution(relaxed=True), True))
+    return rows
+
+
+# Final state, trajectory and profile of the last solve of a method, also when it did not reach optimality
+def run_row(solver):
+    record = getattr(solver, 'record', None)
+    row = pack_record(record) if record is not None else {}
+    profile = solver.get_profile()
+    if profile.phases:
+        row['profile'] = json.dumps(profile.encode())
+    return row or None
+
+
+def failure_reason(e, solver):
+    reason = f"{type(e).__name__}: {e}"
+    if getattr(solver, 'model', None) is not None:
+        reason += f" (status {solver.model.status})"
+    return reason
+
+
+# Whether a failed solve stopped at the time limit, which solving it again would only repeat
+def timed_out(solver):
+    models = [getattr(solver, 'model', None), getattr(solver, 'relaxed_model', None)]
+    return any(model is not None and model.status == GRB.TIME_LIMIT for model in models)
+
+
+# Solve one cell and hand the outcome to the writer, returns the failure reason and whether it is final if it failed
+def run_cell(inst, name, index, i, method, solver, writer: ResultsWriter):
+    try:
+        results = method_results(inst, method, solver)
+        writer.add(name, index, i, method, results, None, solution_rows(method, solver), run_row(solver))
+        return None, False
+    except Exception as e:
+        error, final = failure_reason(e, solver), timed_out(solver)
+        writer.add(name, index, i, method, None, error, run=run_row(solver), final=final)
+        return error, final
 
 
 def single_instance(instance_set: data.InstanceSet, index, i):
-    inst = instance_set.instances[i]
-    piv_solver.solve(inst)
-    lov_solver.solve(inst)
-    tiv_solver.solve(inst)
-    tot_machine_time = 0
-    for machine in inst.machines:
-        mach_time = sum(map(lambda i: inst.tasks[i].s + inst.tasks[i].p, machine.ordering))
-        if mach_time > tot_machine_time:
-            tot_machine_time = mach_time
-
-    res = Results(
-        configuration=index,
-        instance=i + 1,
-        dataset=instance_set.name,
-        makespan_piv=piv_solver.get_solution(relaxed=False).makespan,
-        runtime_piv=piv_solver.get_solution(relaxed=False).solve_time,
-        makespan_piv_r=piv_solver.get_solution(relaxed=True).makespan,
-        runtime_piv_r=piv_solver.get_solution(relaxed=True).solve_time,
-
-        makespan_lov=lov_solver.get_solution(relaxed=False).makespan,
-        runtime_lov=lov_solver.get_solution(relaxed=False).solve_time,
-        makespan_lov_r=lov_solver.get_solution(relaxed=True).makespan,
-        runtime_lov_r=lov_solver.get_solution(relaxed=True).solve_time,
-
-        makespan_tiv=tiv_solver.get_solution(relaxed=False).makespan,
-        runtime_tiv=tiv_solver.get_solution(relaxed=False).solve_time,
-        method_tiv=tiv_solver.get_solution(relaxed=False).method,
-
-        makespan_tiv_r=tiv_solver.get_solution(relaxed=True).makespan,
-        runtime_tiv_r=tiv_solver.get_solution(relaxed=True).solve_time,
-        method_tiv_r=tiv_solver.get_solution(relaxed=False).method,
-
-        max_tot_machine_time=tot_machine_time
-    )
-    session.merge(res)
-    session.commit()
-
-
-def runInstanceSets(instances):
+    writer = ResultsWriter()
+    for method in methods:
+        run_cell(instance_set.instances[i], instance_set.name, index, i, method, solvers[method], writer)
+    writer.flush()
+
+
+# Results columns that are filled once a method has solved an instance
+def result_columns(method):
+    if method not in formulations:
+        return [f'makespan_{method}']
+    return [f'makespan_{method}', f'makespan_{method}_r']
+
+
+# The (dataset, configuration, instance, method) cells still to be solved: all of them, or with resume only those
+# without results that have failed fewer than max_attempts times, and not at the time limit
+def campaign_cells(instances, resume=False, max_attempts=3):
+    cells = []
     for i in reversed(range(len(instances))):
         instance_set = instances[i]
+        done = {}
+        failed = set()
+        if resume:
+            with db.get_engine().connect() as conn:
+                for row in conn.execute(select(Results.__table__).where(
+                        Results.dataset == instance_set.name, Results.configuration == i)):
+                    done[row.instance] = {m for m in methods
+                                          if all(getattr(row, c) is not None for c in result_columns(m))}
+                for row in conn.execute(select(Attempts.__table__).where(
+                        Attempts.dataset == instance_set.name, Attempts.configuration == i)):
+                    if row.error is not None and (row.final or row.attempts >= max_attempts):
+                        failed.add((row.instance, row.method))
         for j in range(len(instance_set.instances)):
-            print(f"Starting instance {j+1} of configuration {i}.")
-            try:
-                single_instance(instance_set, i, j)
-                print(f"Completed instance {j + 1} of configuration {i}.")
-            except Exception:
-                print(f"Failed instance {j + 1} of configuration {i}.")
-                pass
+            for method in methods:
+                if method not in done.get(j + 1, set()) and (j + 1, method) not in failed:
+                    cells.append((instance_set.name, i, j, method))
+    return cells
+
+
+# Check every stored solution of the given datasets (all by default) against its instance,
+# returns the key and violation report of every invalid one
+def verify_solutions(names=None):
+    query = select(db.Solutions.__table__)
+    if names is not None:
+        query = query.where(db.Solutions.dataset.in_(names))
+    checked = 0
+    invalid = []
+    with db.get_engine().connect() as conn:
+        for row in conn.execute(query):
+            if row.dataset not in data.datasets:
+                continue
+            inst = data.datasets[row.dataset][row.configuration].instances[row.instance - 1]
+            report = db.unpack_solution(row, inst).verify(row.relaxed)
+            checked += 1
+            if not report.valid:
+                invalid.append(((row.dataset, row.configuration, row.instance, row.method, row.relaxed), report))
+
+    print(f"Verified {checked} solutions, {len(invalid)} invalid.")
+    for key, report in invalid:
+        print(f"{key}: {report.summary()}")
+    return invalid
+
+
+# Gurobi work until optimality (or the time limit) with and without a heuristic warm start, per formulation
+def warm_start_comparison(instance_set: data.InstanceSet):
+    solvers = {'piv': piv_solver, 'lov': lov_solver, 'tiv': tiv_solver}
+    work = {name: [] for name in solvers}
+    for inst in instance_set.instances:
+        start = heuristic_solver.solve(inst)
+        for name, solver in solvers.items():
+            solver.solve(inst, relaxed=False)
+            cold = solver.get_model().Work
+            solver.solve(inst, relaxed=False, start=start)
+            warm = solver.get_model().Work
+            work[name].append((cold, warm))
+
+    for name in work:
+        cold = sum(map(lambda w: w[0], work[name]))
+        warm = sum(map(lambda w: w[1], work[name]))
+        print(f"{name}: {cold:.2f} -> {warm:.2f} work units ({100 * (1 - warm / cold):.1f}% reduction)")
+    return work
+
+
+# Build time, model size, peak memory and Gurobi work of alternative solvers on the same instances,
+# e.g. {'eager': LOVSolver(), 'lazy': LOVSolver(lazy=True)}
+def solver_comparison(instance_set: data.InstanceSet, solvers: dict):
+    stats = {name: [] for name in solvers}
+    for inst in instance_set.instances:
+        for name, solver in solvers.items():
+            solver.solve(inst, relaxed=False)
+            model = solver.get_model()
+            stats[name].append((solver.build_time, model.NumConstrs, model.MaxMemUsed, model.Work))
+
+    for name in stats:
+        build = sum(map(lambda s: s[0], stats[name]))
+        constrs = max(map(lambda s: s[1], stats[name]))
+        memory = max(map(lambda s: s[2], stats[name]))
+        work = sum(map(lambda s: s[3], stats[name]))
+        print(f"{name}: build {build:.2f} s, up to {constrs} constraints and {memory:.3f} GB, {work:.2f} work units")
+    return stats
+
+
+# Model build time of the expression based and the matrix based builders, per formulation
+def build_benchmark(instance_set: data.InstanceSet):
+    formulations = {'piv': PositionSolver, 'lov': LOVSolver, 'tiv': TIVSolver}
+    times = {}
+    for name, formulation in formulations.items():
+        times[name] = {}
+        for matrix in [False, True]:
+            solver = formulation(matrix=matrix)
+            times[name][matrix] = 0
+            for inst in instance_set.instances:
+                solver.build(inst)
+                times[name][matrix] += solver.build_time
+        print(f"{name}: {times[name][False]:.2f} s -> {times[name][True]:.2f} s "
+              f"({times[name][False] / times[name][True]:.1f}x faster)")
+    return times
+
+
+def runInstanceSets(instances, resume=False, max_attempts=3):
+    writer = ResultsWriter()
+    for name, i, j, method in campaign_cells(instances, resume, max_attempts):
+        print(f"Starting {method} on instance {j + 1} of configuration {i}.")
+        error, _ = run_cell(instances[i].instances[j], name, i, j, method, solvers[method], writer)
+        if error is None:
+            print(f"Completed {method} on instance {j + 1} of configuration {i}.")
+        else:
+            print(f"Failed {method} on instance {j + 1} of configuration {i}.")
+    writer.flush()
+
+
+# Solvers of a worker process of runInstanceSetsParallel, sharing the worker's own Gurobi environment
+worker_solvers = None
+
+
+def init_worker(threads):
+    global worker_solvers
+    env = gp.Env(empty=True)
+    env.setParam("Threads", threads)
+    env.setParam("OutputFlag", 0)
+    env.start()
+    worker_solvers = {'piv': PositionSolver(), 'lov': LOVSolver(), 'tiv': TIVSolver(), 'heuristic': HeuristicSolver(),
+                      'portfolio': PortfolioSolver(threads=threads), 'auto': AutoSolver()}
+    for name in formulations + ['heuristic']:
+        worker_solvers[name].env = env
+    for solver in worker_solvers['auto'].selector.solvers.values():
+        solver.env = env
+    configure_solvers(worker_solvers)
+
+
+def solve_cell(cell):
+    name, index, i, method, inst = cell
+    solver = worker_solvers[method]
+    try:
+        results = method_results(inst, method, solver)
+        return name, index, i, method, results, None, False, solution_rows(method, solver), run_row(solver)
+    except Exception as e:
+        return name, index, i, method, None, failure_reason(e, solver), timed_out(solver), [], run_row(solver)
+
+
+# Solve the instances on a pool of worker processes, each using the given number of Gurobi threads.
+# The results are written to the database by this process only.
+def runInstanceSetsParallel(instances, workers=None, threads=1, resume=False, max_attempts=3):
+    if workers is None:
+        # A portfolio runs all formulations at once, with at least one thread each
+        cores = PortfolioSolver(threads=threads).cores() if 'portfolio' in methods else threads
+        workers = max(1, os.cpu_count() // max(cores, threads))
+    cells = [(name, i, j, method, instances[i].instances[j])
+             for name, i, j, method in campaign_cells(instances, resume, max_attempts)]
+
+    writer = ResultsWriter()
+    with multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(threads,)) as pool:
+        for name, index, i, method, results, error, final, solutions, run in pool.imap_unordered(solve_cell, cells):
+            writer.add(name, index, i, method, results, error, solutions, run, final)
+            if error is None:
+                print(f"Completed {method} on instance {i + 1} of configuration {index}.")
+            else:
+                print(f"Failed {method} on instance {i + 1} of configuration {index}: {error}")
+    writer.flush()
+
+
+def enqueue(instances, resume=True, max_attempts=3):
+    with db.get_engine().begin() as conn:
+        queued = set(conn.execute(select(Jobs.dataset, Jobs.configuration, Jobs.instance, Jobs.method)).all())
+        jobs = [dict(dataset=name, configuration=i, instance=j + 1, method=method, status='queued', attempts=0)
+                for name, i, j, method in campaign_cells(instances, resume, max_attempts)
+                if (name, i, j + 1, method) not in queued]
+        if len(jobs) > 0:
+            conn.execute(insert(Jobs).on_conflict_do_nothing(), jobs)
+    return len(jobs)
+
+
+# Claim the oldest queued job, or a running one whose worker stopped sending heartbeats. Claiming counts as an
+# attempt, so a job that kills its worker (e.g. out of memory) fails once max_attempts workers stopped on it.
+def claim_job(worker, stale_after, max_attempts=3):
+    now = time.time()
+    stale = and_(Jobs.status == 'running', Jobs.heartbeat < now - stale_after)
+    candidate = select(Jobs.id).where(or_(Jobs.status == 'queued', stale)).order_by(Jobs.id).limit(1) \
+        .scalar_subquery()
+    with db.get_engine().begin() as conn:
+        # Jobs whose workers stopped on every attempt are not run again
+        conn.execute(update(Jobs).where(stale, Jobs.attempts >= max_attempts)
+                     .values(status='failed', error="Worker stopped sending heartbeats"))
+        # A single UPDATE is atomic in SQLite, so no two workers get the same job
+        return conn.execute(
+            update(Jobs).where(Jobs.id == candidate)
+            .values(status='running', worker=worker, heartbeat=now, attempts=Jobs.attempts + 1)
+            .returning(Jobs.id, Jobs.dataset, Jobs.configuration, Jobs.instance, Jobs.method)
+        ).first()
+
+
+def send_heartbeats(job_id, worker, stop: Event, interval):
+    while not stop.wait(interval):
+        with db.get_engine().begin() as conn:
+            conn.execute(update(Jobs).where(Jobs.id == job_id, Jobs.worker == worker).values(heartbeat=time.time()))
+
+
+def finish_job(job_id, worker, error, final, max_attempts):
+    with db.get_engine().begin() as conn:
+        attempts = conn.execute(select(Jobs.attempts).where(Jobs.id == job_id)).scalar()
+        if error is None:
+            status = 'done'
+        else:
+            status = 'failed' if final or attempts >= max_attempts else 'queued'
+        conn.execute(update(Jobs).where(Jobs.id == job_id, Jobs.worker == worker).values(status=status, error=error))
+
+
+# Drain the job queue until it is empty
+def work(stale_after=1800, interval=60, max_attempts=3):
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    writer = ResultsWriter()
+    while True:
+        job = claim_job(worker, stale_after, max_attempts)
+        if job is None:
+            return
+        print(f"Worker {worker} starting {job.method} on instance {job.instance} of configuration "
+              f"{job.configuration} of {job.dataset}.")
+        stop = Event()
+        Thread(target=send_heartbeats, args=(job.id, worker, stop, interval), daemon=True).start()
+        try:
+            inst = data.datasets[job.dataset][job.configuration].instances[job.instance - 1]
+            error, final = run_cell(inst, job.dataset, job.configuration, job.instance - 1, job.method,
+                                    solvers[job.method], writer)
+        finally:
+            stop.set()
+        # The results have to be stored before the job is marked as done
+        writer.flush()
+        finish_job(job.id, worker, error, final, max_attempts)
+
+
+def work_local(processes, stale_after=1800, interval=60, max_attempts=3):
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=work, args=(stale_after, interval, max_attempts)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'enqueue', 'work', 'verify'])
+    parser.add_argument('--datasets', nargs='+', default=['I'], choices=list(data.datasets))
+    parser.add_argument('--processes', type=int, default=1, help="Local worker processes for work")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Pool worker processes for run, 0 for as many as the cores allow")
+    parser.add_argument('--threads', type=int,
+                        help="Gurobi threads of each run, 1 per pool worker by default and all cores otherwise")
+    parser.add_argument('--methods', nargs='+', default=methods, choices=list(solvers),
+                        help="Methods to run or enqueue, portfolio races the formulations and auto "
+                             "picks one per instance")
+    parser.add_argument('--stale-after', type=float, default=1800,
+                        help="Seconds without heartbeat after which a running job is reclaimed")
+    parser.add_argument('--db', default=os.environ.get('RESULTS_DB', '../db/results.db'))
+    parser.add_argument('--echo', action='store_true', help="Log every SQL statement")
+    parser.add_argument('--cache', default=os.environ.get('SOLUTION_CACHE'),
+                        help="Solution cache database, optimal solutions found there are not solved again")
+    parser.add_argument('--shared-relaxation', action='store_true',
+                        help="Solve each LP relaxation on its MIP model instead of on a relaxed copy")
+    parser.add_argument('--profile', action='store_true',
+                        help="Store cProfile statistics of the Python side phases with the runs")
+    parser.add_argument('--check', action='store_true', help="Verify every solution as soon as it is extracted")
+    parser.add_argument('--trajectory', type=float, metavar='SECONDS',
+                        help="Record the incumbent and bound of every MIP solve at this interval and at every new "
+                             "incumbent, which slows down the solves")
+    parser.add_argument('--selector', default=os.environ.get('SELECTOR'),
+                        help="Runtime models of the auto method, written by selector.py learn")
+    parser.add_argument('--memory-budget', type=float, help="MB the models of the auto method may take")
+    args = parser.parse_args()
 
+    # Worker processes connect through the environment
+    os.environ['RESULTS_DB'] = args.db
+    os.environ['SQL_ECHO'] = '1' if args.echo else '0'
+    db.connect(args.db, args.echo)
+    methods = args.methods
+    if args.cache:
+        os.environ['SOLUTION_CACHE'] = args.cache
+    if args.shared_relaxation:
+        os.environ['SHARED_RELAXATION'] = '1'
+    if args.profile:
+        os.environ['PROFILE_PYTHON'] = '1'
+    if args.check:
+        os.environ['CHECK_SOLUTIONS'] = '1'
+    if args.trajectory is not None:
+        os.environ['RECORD_INTERVAL'] = str(args.trajectory)
+    if args.selector:
+        os.environ['SELECTOR'] = args.selector
+    if args.memory_budget is not None:
+        os.environ['MEMORY_BUDGET'] = str(args.memory_budget)
+    configure_solvers(solvers)
 
-runInstanceSets(data.instances_I)
+    if args.command == 'run' and args.workers != 1:
+        for name in args.datasets:
+            runInstanceSetsParallel(data.datasets[name], args.workers or None, args.threads or 1, resume=True)
+    elif args.command == 'run':
+        if args.threads is not None:
+            for name in formulations:
+                solvers[name].params["Threads"] = args.threads
+            portfolio_solver.threads = args.threads
+        for name in args.datasets:
+            runInstanceSets(data.datasets[name], resume=True)
+    elif args.command == 'enqueue':
+        for name in args.datasets:
+            print(f"Queued {enqueue(data.datasets[name])} jobs of {name}.")
+    elif args.command == 'verify':
+        verify_solutions(args.datasets)
+    else:
+        work_local(args.processes, args.stale_after)
@@ -0,0 +1,282 @@
+import os
+import zlib
+
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, Boolean, LargeBinary
+from sqlalchemy import Index, UniqueConstraint, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from solver import *
+
+Model = declarative_base(name='Model')
+
+
+class Results(Model):
+    __tablename__ = 'results'
+    __table_args__ = (Index('ix_results_dataset_configuration', 'dataset', 'configuration'),)
+    configuration = Column(Integer, primary_key=True)
+    instance = Column(Integer, primary_key=True)
+    dataset = Column(String, primary_key=True)
+    # PIV
+    makespan_piv = Column(Float)
+    runtime_piv = Column(Float)
+    method_piv = Column(String)
+    # PIV Relaxation
+    makespan_piv_r = Column(Float)
+    runtime_piv_r = Column(Float)
+    method_piv_r = Column(String)
+    # LOV
+    makespan_lov = Column(Float)
+    runtime_lov = Column(Float)
+    # LOV Relaxation
+    makespan_lov_r = Column(Float)
+    runtime_lov_r = Column(Float)
+    # TIV
+    makespan_tiv = Column(Float)
+    runtime_tiv = Column(Float)
+    method_tiv = Column(String)
+    # TIV Relaxation
+    makespan_tiv_r = Column(Float)
+    runtime_tiv_r = Column(Float)
+    method_tiv_r = Column(String)
+    # Heuristic Value
+    makespan_heuristic = Column(Float)
+    runtime_heuristic = Column(Float)
+    # Portfolio race, with the formulation that won it
+    makespan_portfolio = Column(Float)
+    runtime_portfolio = Column(Float)
+    method_portfolio = Column(String)
+    # Formulation picked by the selector
+    makespan_auto = Column(Float)
+    runtime_auto = Column(Float)
+    method_auto = Column(String)
+    # Max total machine time
+    max_tot_machine_time = Column(Float)
+
+
+# Attempts at solving a (configuration, instance, dataset) cell with one method
+class Attempts(Model):
+    __tablename__ = 'attempts'
+    __table_args__ = (Index('ix_attempts_dataset_configuration', 'dataset', 'configuration'),)
+    configuration = Column(Integer, primary_key=True)
+    instance = Column(Integer, primary_key=True)
+    dataset = Column(String, primary_key=True)
+    method = Column(String, primary_key=True)
+    attempts = Column(Integer)
+    # Reason of the last failure, None if the last attempt succeeded
+    error = Column(String)
+    # The last failure would only repeat, e.g. at the time limit, so the cell is not tried again
+    final = Column(Boolean)
+
+
+# Queue of (dataset, configuration, instance, method) cells, drained by any number of worker processes
+class Jobs(Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (UniqueConstraint('dataset', 'configuration', 'instance', 'method'),
+                      Index('ix_jobs_status_heartbeat', 'status', 'heartbeat'))
+    id = Column(Integer, primary_key=True)
+    dataset = Column(String)
+    configuration = Column(Integer)
+    instance = Column(Integer)
+    method = Column(String)
+    # queued, running, done or failed
+    status = Column(String)
+    worker = Column(String)
+    heartbeat = Column(Float)
+    attempts = Column(Integer)
+    error = Column(String)
+
+
+# Solutions found by every method, with the server order and start times as compressed arrays
+class Solutions(Model):
+    __tablename__ = 'solutions'
+    configuration = Column(Integer, primary_key=True)
+    instance = Column(Integer, primary_key=True)
+    dataset = Column(String, primary_key=True)
+    method = Column(String, primary_key=True)
+    relaxed = Column(Boolean, primary_key=True)
+    makespan = Column(Float)
+    server_order = Column(LargeBinary)
+    start_times = Column(LargeBinary)
+
+
+# Final state and progress of the MIP solve of every formulation, also for runs that were not solved to optimality
+class Runs(Model):
+    __tablename__ = 'runs'
+    configuration = Column(Integer, primary_key=True)
+    instance = Column(Integer, primary_key=True)
+    dataset = Column(String, primary_key=True)
+    method = Column(String, primary_key=True)
+    status = Column(Integer)
+    incumbent = Column(Float)
+    bound = Column(Float)
+    gap = Column(Float)
+    work = Column(Float)
+    nodes = Column(Float)
+    # Rows of (wall time, work, incumbent, bound, nodes)
+    trajectory = Column(LargeBinary)
+    # JSON of solver.Profile: seconds and peak RSS per phase, model size and optional cProfile statistics
+    profile = Column(String)
+
+
+def pack_record(record: SolveRecord):
+    return dict(
+        status=record.status,
+        incumbent=record.incumbent,
+        bound=record.bound,
+        gap=record.gap,
+        work=record.work,
+        nodes=record.nodes,
+        trajectory=zlib.compress(np.ascontiguousarray(record.trajectory, dtype=np.float64).tobytes())
+    )
+
+
+def unpack_trajectory(row) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(row.trajectory), dtype=np.float64).reshape(-1, 5)
+
+
+def pack_solution(solution: Solution, relaxed):
+    order = np.asarray(solution.server_order, dtype=np.int32)
+    start = np.array([solution.task_times[j][0] for j in range(len(solution.task_times))], dtype=np.float64)
+    return dict(
+        relaxed=relaxed,
+        makespan=solution.makespan,
+        server_order=zlib.compress(order.tobytes()),
+        start_times=zlib.compress(start.tobytes())
+    )
+
+
+# End times are not stored, every task ends its setup and processing time after its start
+def unpack_solution(row, instance: Instance = None) -> Solution:
+    order = np.frombuffer(zlib.decompress(row.server_order), dtype=np.int32)
+    start = np.frombuffer(zlib.decompress(row.start_times), dtype=np.float64)
+    task_times = {j: (float(start[j]), None) for j in range(len(start))}
+    if instance is not None:
+        end = start + instance.arrays.s + instance.arrays.p
+        task_times = dict(enumerate(zip(start.tolist(), end.tolist())))
+    return Solution(
+        server_order=order.tolist(),
+        task_times=task_times,
+        makespan=row.makespan,
+        method=row.method,
+        instance=instance
+    )
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Readers do not block the writer and commits only fsync at checkpoints
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+# Set by connect, from the entry points or on first use by get_engine; importing this module touches no database
+engine = None
+session = None
+
+
+def connect(path='../db/results.db', echo=False):
+    global engine, session
+    # Several worker processes may share the database file, so wait for locks instead of failing
+    engine = create_engine(f'sqlite:///{path}', echo=echo, connect_args={'timeout': 60})
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+    Model.metadata.create_all(engine)
+    # create_all does not add the columns that were added to a table after it was created
+    existing = inspect(engine)
+    with engine.begin() as conn:
+        for table in Model.metadata.sorted_tables:
+            columns = {c['name'] for c in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                         f"{column.type.compile(engine.dialect)}")
+    # create_all skips the indexes of tables that already exist
+    for table in Model.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    session = sessionmaker(bind=engine)()
+    return engine
+
+
+# Engine of the results database, connecting to RESULTS_DB (echoing SQL with SQL_ECHO=1) on first use, so that
+# worker processes reach the database of their parent
+def get_engine():
+    if engine is None:
+        connect(os.environ.get('RESULTS_DB', '../db/results.db'), os.environ.get('SQL_ECHO', '0') == '1')
+    return engine
+
+
+run_columns = [c.name for c in Runs.__table__.columns if not c.primary_key]
+
+
+class ResultsWriter:
+    """
+    Buffers the outcome of solved cells and writes them to the database in batches of upserts.
+
+    A batch is written once batch_size cells are buffered or interval seconds have passed since the last write.
+    """
+
+    def __init__(self, batch_size=50, interval=30):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.results = []
+        self.attempts = []
+        self.solutions = []
+        self.runs = []
+        self.last_flush = time.time()
+
+    def add(self, name, index, i, method, results, error, solutions=(), run=None, final=False):
+        key = dict(configuration=index, instance=i + 1, dataset=name)
+        if results is not None:
+            self.results.append({**key, **results})
+        self.attempts.append({**key, 'method': method, 'attempts': 1, 'error': error, 'final': final})
+        for solution in solutions:
+            self.solutions.append({**key, 'method': method, **solution})
+        if run is not None:
+            # Rows of a batch are inserted together, so all of them need every column
+            self.runs.append({**dict.fromkeys(run_columns), **key, 'method': method, **run})
+        if len(self.attempts) >= self.batch_size or time.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with get_engine().begin() as conn:
+            # Every method fills its own columns of a row, so rows are upserted per set of columns
+            groups = {}
+            for row in self.results:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            for columns, rows in groups.items():
+                stmt = insert(Results)
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=['configuration', 'instance', 'dataset'],
+                    set_={c: stmt.excluded[c] for c in columns if c not in ('configuration', 'instance', 'dataset')}
+                ), rows)
+
+            if len(self.attempts) > 0:
+                stmt = insert(Attempts)
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=['configuration', 'instance', 'dataset', 'method'],
+                    set_={'attempts': Attempts.attempts + 1, 'error': stmt.excluded.error, 'final': stmt.excluded.final}
+                ), self.attempts)
+
+            if len(self.solutions) > 0:
+                stmt = insert(Solutions)
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=['configuration', 'instance', 'dataset', 'method', 'relaxed'],
+                    set_={c: stmt.excluded[c] for c in ('makespan', 'server_order', 'start_times')}
+                ), self.solutions)
+
+            if len(self.runs) > 0:
+                stmt = insert(Runs)
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=['configuration', 'instance', 'dataset', 'method'],
+                    set_={c.name: stmt.excluded[c.name] for c in Runs.__table__.columns if not c.primary_key}
+                ), self.runs)
+
+        self.results = []
+        self.attempts = []
+        self.solutions = []
+        self.runs = []
+        self.last_flush = time.time()
+
@@ -0,0 +1,127 @@
+from solver import *
+
+
+@dataclass
+class Evaluation:
+    start: np.ndarray  # (k, n) start time per task id
+    end: np.ndarray  # (k, n) completion time per task id
+    makespan: np.ndarray  # (k,), inf for infeasible orders
+    feasible: np.ndarray  # (k,) bool
+
+
+@dataclass
+class Verification:
+    missing: np.ndarray  # task ids not in the server order
+    repeated: np.ndarray  # task ids more than once in the server order
+    duration: np.ndarray  # task ids whose end is not their start plus s and p
+    server: np.ndarray  # positions in the server order whose task starts before the previous setup has finished
+    machine: np.ndarray  # task ids that start before their machine predecessor has completed
+    makespan: float  # makespan of the solution minus its last completion time
+
+    @property
+    def valid(self):
+        return all(len(v) == 0 for v in [self.missing, self.repeated, self.duration, self.server, self.machine]) \
+            and abs(self.makespan) <= delta
+
+    def summary(self):
+        if self.valid:
+            return "valid"
+        counts = {name: len(getattr(self, name)) for name in ['missing', 'repeated', 'duration', 'server', 'machine']}
+        parts = [f"{count} {name}" for name, count in counts.items() if count > 0]
+        if abs(self.makespan) > delta:
+            parts.append(f"makespan off by {self.makespan:g}")
+        return ", ".join(parts)
+
+
+def instance_arrays(instance: Instance):
+    arrays = instance.arrays
+    return arrays.s, arrays.p, arrays.machine_of, arrays.pos_in_machine
+
+
+# Work of the machine predecessors (head) and machine successors (tail) of every task
+def heads_tails(instance: Instance):
+    return instance.arrays.head, instance.arrays.tail
+
+
+# Machine predecessor of every task, -1 for the first task of a machine
+def predecessors(instance: Instance):
+    arrays = instance.arrays
+    pred = np.full(len(arrays.s), -1)
+    later = arrays.pos_in_machine[arrays.order] > 0
+    pred[arrays.order[1:][later[1:]]] = arrays.order[:-1][later[1:]]
+    return pred
+
+
+# Earliest start schedule for one or many server orders.
+# Each row of orders is a permutation of task ids; a task starts as soon as the server has finished the previous
+# setup and its machine predecessor has completed. Rows that are not permutations, or that visit the tasks of a
+# machine out of Machine.ordering, are infeasible and get an infinite makespan.
+def evaluate(instance: Instance, orders) -> Evaluation:
+    s, p, machine_of, pos_in_machine = instance_arrays(instance)
+    orders = np.atleast_2d(np.asarray(orders, dtype=np.int64))
+    k, n = orders.shape
+    if n != len(s):
+        raise Exception(f"Server orders have {n} tasks, instance has {len(s)}")
+
+    rows = np.arange(k)
+    feasible = (np.sort(orders, axis=1) == np.arange(n)).all(axis=1)
+    orders = np.where(feasible[:, None], orders, np.arange(n))
+
+    server_free = np.zeros(k)
+    machine_free = np.zeros((k, len(instance.machines)))
+    machine_next = np.zeros((k, len(instance.machines)), dtype=np.int64)
+    start = np.empty((k, n))
+    for i in range(n):
+        j = orders[:, i]
+        mach = machine_of[j]
+        feasible &= machine_next[rows, mach] == pos_in_machine[j]
+        st = np.maximum(server_free, machine_free[rows, mach])
+        start[rows, j] = st
+        server_free = st + s[j]
+        machine_free[rows, mach] = server_free + p[j]
+        machine_next[rows, mach] += 1
+
+    makespan = machine_free.max(axis=1)
+    makespan[~feasible] = np.inf
+    return Evaluation(start=start, end=start + s + p, makespan=makespan, feasible=feasible)
+
+
+# Check a solution against its instance, reporting every violation instead of stopping at the first.
+# Relaxed solutions are only checked for a complete server order and consistent task times, since their schedule
+# need not be feasible.
+def verify(instance: Instance, solution: Solution, relaxed=False) -> Verification:
+    s, p, _, _ = instance_arrays(instance)
+    n = len(s)
+    order = np.asarray(solution.server_order, dtype=np.int64).ravel()
+    known = order[(order >= 0) & (order < n)]
+    count = np.bincount(known, minlength=n)
+
+    # Tasks without times get NaN, which fails every check
+    times = np.array([solution.task_times.get(j, (None, None)) for j in range(n)], dtype=float).reshape(n, 2)
+    start, end = times[:, 0], times[:, 1]
+    duration = np.flatnonzero(~(np.abs(end - start - s - p) <= delta))
+
+    server = machine = np.zeros(0, dtype=np.int64)
+    makespan = 0.0
+    if not relaxed:
+        server = 1 + np.flatnonzero(~(start[known[:-1]] + s[known[:-1]] <= start[known[1:]] + delta))
+        pred = predecessors(instance)
+        later = np.flatnonzero(pred >= 0)
+        machine = later[~(end[pred[later]] <= start[later] + delta)]
+        makespan = float(solution.makespan - np.max(end, initial=0))
+
+    return Verification(missing=np.flatnonzero(count == 0), repeated=np.flatnonzero(count > 1),
+                        duration=duration, server=server, machine=machine, makespan=makespan)
+
+
+def schedule(instance: Instance, order) -> Solution:
+    evaluation = evaluate(instance, order)
+    if not evaluation.feasible[0]:
+        raise Exception("Server order does not respect the machine orderings")
+    order = list(map(int, np.asarray(order).ravel()))
+    return Solution(
+        server_order=order,
+        task_times={j: (float(evaluation.start[0, j]), float(evaluation.end[0, j])) for j in order},
+        makespan=float(evaluation.makespan[0]),
+        instance=instance
+    )
@@ -0,0 +1,125 @@
+import argparse
+import os
+
+from instance import *
+from myinstances import U, describe
+
+# Tasks drawn and written at a time
+chunk_size = 2 ** 16
+
+
+def balanced(jobs, machines):
+    counts = np.full(machines, jobs // machines)
+    counts[machines - jobs % machines:] += 1
+    return counts.tolist()
+
+
+# A new unbalanced layout for sizes that dataset1 does not have: the first machine gets about twice the jobs of each
+# of the others. The unbalanced splits of dataset1 follow no single rule, see dataset1_counts.
+def unbalanced(jobs, machines):
+    first = round(2 * jobs / (machines + 1))
+    return [first] + balanced(jobs - first, machines - 1)
+
+
+# Jobs per machine of the instances of dataset1, by (jobs, machines, variant)
+dataset1_counts = {
+    (30, 3, 1): [10, 10, 10],
+    (30, 3, 2): [14, 8, 8],
+    (50, 3, 1): [16, 17, 17],
+    (50, 3, 2): [20, 15, 15],
+    (100, 3, 1): [34, 33, 33],
+    (100, 3, 2): [40, 40, 20],
+    (30, 5, 1): [6, 6, 6, 6, 6],
+    (30, 5, 2): [10, 5, 5, 5, 5],
+    (50, 5, 1): [10, 10, 10, 10, 10],
+    (50, 5, 2): [18, 8, 8, 8, 8],
+    (100, 5, 1): [20, 20, 20, 20, 20],
+    (100, 5, 2): [32, 17, 17, 17, 17],
+}
+
+
+# Configurations (setup, processing, machine counts) of the dataset families at any number of jobs.
+# Family I has s = 1 and p ~ U[0, 20] on 3 or 5 machines, balanced (variant 1) or not (variant 2), with the machine
+# counts of dataset1 at its sizes and the balanced and unbalanced layouts above at any other size;
+# families II and III have p ~ U[0, k] on 3 and 5 balanced machines, with s = 1 (A) or s ~ U[1, 3] (B).
+def config_I(jobs, machines=3, variant=1):
+    counts = dataset1_counts.get((jobs, machines, variant))
+    if counts is None:
+        counts = (balanced if variant == 1 else unbalanced)(jobs, machines)
+    return 1, U(0, 20), counts
+
+
+def config_IIA(jobs, k=10):
+    return 1, U(0, k), balanced(jobs, 3)
+
+
+def config_IIB(jobs, k=10):
+    return U(1, 3), U(0, k), balanced(jobs, 3)
+
+
+def config_IIIA(jobs, k=10):
+    return 1, U(0, k), balanced(jobs, 5)
+
+
+def config_IIIB(jobs, k=10):
+    return U(1, 3), U(0, k), balanced(jobs, 5)
+
+
+families = {
+    'I': config_I,
+    'IIA': config_IIA,
+    'IIB': config_IIB,
+    'IIIA': config_IIIA,
+    'IIIB': config_IIIB,
+}
+
+
+# Write instance i of a configuration in the text format, drawing and writing chunk_size tasks at a time.
+# The setup and processing times have their own random streams, determined by seed and i.
+def write_instance(path, config, seed, i=0):
+    setups, processing, counts = config
+    n = sum(counts)
+    rng_s, rng_p = map(np.random.default_rng, np.random.SeedSequence([seed, i]).spawn(2))
+    with open(path, "w") as f:
+        f.write("---------------\n")
+        f.write(describe(setups, processing, counts, i) + f"\nSeed: {seed}")
+        f.write("\n---------------\n")
+        f.write(f"{n} {len(counts)}\n")
+        f.write(" ".join(map(str, counts)) + "\n")
+        for start in range(0, n, chunk_size):
+            size = min(chunk_size, n - start)
+            s = draw(setups, size, rng_s)
+            p = draw(processing, size, rng_p)
+            f.write("".join(map("{} {}\n".format, s.tolist(), p.tolist())))
+
+
+# Write n instances of every number of jobs to file_{i}_{j}.txt, configuration i being the i-th number of jobs,
+# in the layout read by myinstances.read_config_instances and packed.convert
+def write_suite(file, family, jobs, n=10, seed=0, **params):
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    for i, size in enumerate(jobs):
+        config = families[family](size, **params)
+        for j in range(n):
+            write_instance(file + f"_{i+1}_{j+1}.txt", config, seed + i, j)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate scaling suites of large instances")
+    parser.add_argument('family', choices=list(families))
+    parser.add_argument('--jobs', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6])
+    parser.add_argument('--instances', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--machines', type=int, help="Machines of family I")
+    parser.add_argument('--variant', type=int, choices=[1, 2], help="Variant of family I")
+    parser.add_argument('-k', type=int, help="Largest processing time of families II and III")
+    parser.add_argument('--out', help="Path prefix of the files, ../scaling/<family>/data by default")
+    parser.add_argument('--pack', action='store_true', help="Also write the packed dataset")
+    args = parser.parse_args()
+
+    params = {name: value for name, value in [('machines', args.machines), ('variant', args.variant), ('k', args.k)]
+              if value is not None}
+    file = args.out or f"../scaling/{args.family}/data"
+    write_suite(file, args.family, args.jobs, args.instances, args.seed, **params)
+    if args.pack:
+        from packed import convert
+        convert(file)
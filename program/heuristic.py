@@ -0,0 +1,185 @@
+from evaluator import *
+
+
+def machine_work(instance: Instance):
+    return instance.arrays.work.tolist()
+
+
+# Longest remaining machine work first: always continue the machine with the most work left.
+def longest_remaining_work(instance: Instance):
+    arrays = instance.arrays
+    s, p, order_of = arrays.s.tolist(), arrays.p.tolist(), arrays.order.tolist()
+    remaining = machine_work(instance)
+    nxt = arrays.machine_offsets[:-1].tolist()
+    end = arrays.machine_offsets[1:].tolist()
+    order = []
+    for _ in range(len(s)):
+        m = max((mi for mi in range(len(nxt)) if nxt[mi] < end[mi]), key=lambda mi: remaining[mi])
+        j = order_of[nxt[m]]
+        order.append(j)
+        remaining[m] -= s[j] + p[j]
+        nxt[m] += 1
+    return order
+
+
+# Earliest available machine: continue the machine whose next task can start first, ties broken by remaining work.
+def earliest_available_machine(instance: Instance):
+    arrays = instance.arrays
+    s, p, order_of = arrays.s.tolist(), arrays.p.tolist(), arrays.order.tolist()
+    remaining = machine_work(instance)
+    nxt = arrays.machine_offsets[:-1].tolist()
+    end = arrays.machine_offsets[1:].tolist()
+    free = [0 for _ in nxt]
+    server = 0
+    order = []
+    for _ in range(len(s)):
+        m = min((mi for mi in range(len(nxt)) if nxt[mi] < end[mi]),
+                key=lambda mi: (max(server, free[mi]), -remaining[mi]))
+        j = order_of[nxt[m]]
+        order.append(j)
+        server = max(server, free[m]) + s[j]
+        free[m] = server + p[j]
+        remaining[m] -= s[j] + p[j]
+        nxt[m] += 1
+    return order
+
+
+rules = {
+    'lrw': longest_remaining_work,
+    'eam': earliest_available_machine,
+}
+
+
+class LocalSearch:
+    """
+    First improvement local search over server orders using insertions, which move a single task to another position.
+    An adjacent swap is the insertion of a task one position further.
+
+    Only moves that keep every machine sequence intact are generated. The schedule state in front of every position
+    of the current order is kept, so a move is evaluated from the first position it changes, and the evaluation is
+    abandoned as soon as a lower bound on its makespan reaches the current one.
+    """
+
+    def __init__(self, instance: Instance, order):
+        s, p, machine_of, _ = instance_arrays(instance)
+        self.s = s.tolist()
+        self.p = p.tolist()
+        self.machine_of = machine_of.tolist()
+        self.machines = len(instance.machines)
+
+        # Work that still has to follow a task on its machine
+        self.tail = instance.arrays.tail.tolist()
+
+        self.order = list(order)
+        self.position = [0 for _ in self.order]
+        self.states = [None for _ in range(len(self.order) + 1)]
+        self.states[0] = (0.0, [0.0] * self.machines, 0.0)
+        self.makespan = self.update(0)
+
+    # Recompute the stored states of the current order from position i onward.
+    def update(self, i):
+        server, free, bound = self.states[i]
+        free = list(free)
+        for k in range(i, len(self.order)):
+            j = self.order[k]
+            self.position[j] = k
+            m = self.machine_of[j]
+            server = max(server, free[m]) + self.s[j]
+            free[m] = server + self.p[j]
+            bound = max(bound, free[m] + self.tail[j])
+            self.states[k + 1] = (server, list(free), bound)
+        return bound
+
+    # Makespan of the current order with positions i, i+1, ... replaced by tasks, or inf if it is not below cutoff.
+    def evaluate(self, i, tasks, cutoff):
+        server, free, bound = self.states[i]
+        free = list(free)
+        for j in tasks:
+            m = self.machine_of[j]
+            server = max(server, free[m]) + self.s[j]
+            free[m] = server + self.p[j]
+            bound = max(bound, free[m] + self.tail[j])
+            if bound >= cutoff:
+                return float('inf')
+        return bound
+
+    def apply(self, i, tasks, makespan):
+        self.order[i:] = tasks
+        self.update(i)
+        self.makespan = makespan
+
+    def improve(self):
+        order = self.order
+        n = len(order)
+        for a in range(n):
+            j = order[a]
+            m = self.machine_of[j]
+            # Window in which j can be placed without passing a task of its own machine
+            lo = a
+            while lo > 0 and self.machine_of[order[lo - 1]] != m:
+                lo -= 1
+            hi = a
+            while hi < n - 1 and self.machine_of[order[hi + 1]] != m:
+                hi += 1
+            for b in range(lo, hi + 1):
+                if b == a:
+                    continue
+                if b < a:
+                    tasks = [j] + order[b:a] + order[a + 1:]
+                    i = b
+                else:
+                    tasks = order[a + 1:b + 1] + [j] + order[b + 1:]
+                    i = a
+                makespan = self.evaluate(i, tasks, self.makespan)
+                if makespan < self.makespan:
+                    self.apply(i, tasks, makespan)
+                    return True
+        return False
+
+    def run(self, time_limit=None):
+        start = time.perf_counter()
+        while self.improve():
+            if time_limit is not None and time.perf_counter() - start > time_limit:
+                break
+        return self.order, self.makespan
+
+
+class HeuristicSolver(Solver):
+    def __init__(self, rules=('lrw', 'eam'), local_search=True, time_limit=None):
+        super().__init__('heuristic')
+        self.rules = rules
+        self.local_search = local_search
+        self.time_limit = time_limit
+
+    # The heuristic builds no model
+    def add_variables(self):
+        pass
+
+    def add_constraints(self):
+        pass
+
+    def extract_solution(self, relaxed) -> Solution:
+        return self.get_solution(relaxed)
+
+    def solve(self, instance: Instance, standard=True, relaxed=False):
+        self.reset()
+        self.instance = instance
+
+        start = time.perf_counter()
+        with self.phase("construct"):
+            candidates = [rules[rule](instance) for rule in self.rules]
+            makespans = evaluate(instance, candidates).makespan
+        best = int(np.argmin(makespans))
+        order = candidates[best]
+        method = self.rules[best]
+
+        if self.local_search:
+            with self.phase("local_search"):
+                order, _ = LocalSearch(instance, order).run(self.time_limit)
+            method = method + "+ls"
+
+        with self.phase("extract"):
+            self.solution = schedule(instance, order)
+        self.solution.solve_time = time.perf_counter() - start
+        self.solution.method = method
+        return self.solution
@@ -1,12 +1,26 @@
+import hashlib
 import re
-from dataclasses import dataclass
+from collections.abc import Sequence
+from dataclasses import dataclass, field
 
 from uuid import UUID, uuid4
 import numpy as np
 from pathlib import Path
 
 
-@dataclass
+# n values of a time distribution: a constant, or a function drawing one value (see myinstances.U),
+# drawn all at once by rng when it has low and high bounds
+def draw(distribution, n, rng=None):
+    if type(distribution) == int:
+        return np.full(n, distribution)
+    if hasattr(distribution, 'low'):
+        if rng is None:
+            return np.random.randint(distribution.low, distribution.high + 1, size=n)
+        return rng.integers(distribution.low, distribution.high + 1, size=n)
+    return np.array([distribution() for _ in range(n)])
+
+
+@dataclass(slots=True)
 class Task:
     id: int
     p: float
@@ -23,9 +37,9 @@ class Task:
         return {'id': self.id, 'p': self.p, 's': self.s}
 
 
-@dataclass
+@dataclass(slots=True)
 class Machine:
-    ordering: list[int]
+    ordering: list[int]  # or a range for array backed instances
     instance: object = None
     id: int = 0
 
@@ -46,7 +60,66 @@ class Machine:
         return Machine(id=table['id'], ordering=table['ordering'])
 
     def encode(self):
-        return {'id': self.id, 'ordering': self.ordering}
+        return {'id': self.id, 'ordering': list(self.ordering)}
+
+
+class Tasks(Sequence):
+    """
+    Tasks of an array backed instance, every access creates a Task from the arrays.
+    """
+    __slots__ = ('s', 'p')
+
+    def __init__(self, s, p):
+        self.s = s
+        self.p = p
+
+    def __len__(self):
+        return len(self.s)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        return Task(id=item, p=self.p[item].item(), s=self.s[item].item())
+
+
+@dataclass(slots=True)
+class InstanceArrays:
+    s: np.ndarray  # setup time per task id
+    p: np.ndarray  # processing time per task id
+    machine_of: np.ndarray  # machine per task id
+    pos_in_machine: np.ndarray  # position of every task in its machine ordering
+    order: np.ndarray  # task ids machine by machine, each in its machine ordering
+    machine_offsets: np.ndarray  # the tasks of machine i are order[machine_offsets[i]:machine_offsets[i + 1]]
+    head: np.ndarray  # setup and processing time of the machine predecessors of every task
+    tail: np.ndarray  # setup and processing time of the machine successors of every task
+    work: np.ndarray  # total setup and processing time per machine
+
+    @staticmethod
+    def build(s, p, orderings):
+        counts = np.array([len(o) for o in orderings], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        order = np.concatenate([np.asarray(o, dtype=np.int64) for o in orderings]) if len(orderings) > 0 \
+            else np.zeros(0, dtype=np.int64)
+        first = np.repeat(offsets[:-1], counts)
+
+        machine_of = np.empty(len(s), dtype=np.int64)
+        machine_of[order] = np.repeat(np.arange(len(counts)), counts)
+        pos_in_machine = np.empty(len(s), dtype=np.int64)
+        pos_in_machine[order] = np.arange(len(order)) - first
+
+        # Prefix sums of the work along the concatenated machine orderings
+        w = (s + p)[order]
+        acc = np.concatenate(([0], np.cumsum(w)))
+        work = acc[offsets[1:]] - acc[offsets[:-1]]
+        head = np.empty(len(s), dtype=acc.dtype)
+        head[order] = acc[:-1] - acc[first]
+        tail = np.empty(len(s), dtype=acc.dtype)
+        tail[order] = np.repeat(work, counts) - head[order] - w
+
+        return InstanceArrays(s=s, p=p, machine_of=machine_of, pos_in_machine=pos_in_machine, order=order,
+                              machine_offsets=offsets, head=head, tail=tail, work=work)
 
 
 @dataclass
@@ -54,6 +127,7 @@ class Instance:
     tasks: list[Task]
     machines: list[Machine]
     uuid: UUID = None
+    _arrays: InstanceArrays = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         if self.uuid is None:
@@ -64,6 +138,38 @@ class Instance:
             machine.id = i
             i += 1
 
+    # Instance with s and p given per task id, where machine i owns the next machine_counts[i] task ids.
+    # The arrays are used as they are, tasks and machine orderings are views on them.
+    @staticmethod
+    def from_arrays(s, p, machine_counts, uuid=None):
+        offsets = np.concatenate(([0], np.cumsum(machine_counts, dtype=np.int64))).tolist()
+        machines = [Machine(id=i, ordering=range(offsets[i], offsets[i + 1])) for i in range(len(machine_counts))]
+        return Instance(tasks=Tasks(np.asarray(s), np.asarray(p)), machines=machines, uuid=uuid)
+
+    # Array form of the instance, built on first use
+    @property
+    def arrays(self) -> InstanceArrays:
+        if self._arrays is None:
+            if isinstance(self.tasks, Tasks):
+                s, p = self.tasks.s, self.tasks.p
+            else:
+                ids = np.array([t.id for t in self.tasks], dtype=np.int64)
+                s = np.array([t.s for t in self.tasks])
+                p = np.array([t.p for t in self.tasks])
+                s[ids], p[ids] = s.copy(), p.copy()
+            self._arrays = InstanceArrays.build(s, p, [m.ordering for m in self.machines])
+        return self._arrays
+
+    # Hash of the setup and processing times and the machine orderings, the same for every load of an instance
+    def digest(self):
+        arrays = self.arrays
+        h = hashlib.sha256()
+        h.update(np.stack((np.arange(len(arrays.s)), arrays.s, arrays.p), axis=1).astype(np.float64).tobytes())
+        for i in range(len(self.machines)):
+            h.update(arrays.order[arrays.machine_offsets[i]:arrays.machine_offsets[i + 1]].tobytes())
+            h.update(b"|")
+        return h.hexdigest()
+
     @staticmethod
     def decode(table):
         return Instance(
@@ -83,24 +189,7 @@ class Instance:
     @staticmethod
     def generate(setups, processing, machineCounts):
         task_count = sum(machineCounts)
-        tasks = []
-        for i in range(task_count):
-            s, p = None, None
-            if type(setups) == int:
-                s = setups
-            else:
-                s = setups()
-            if type(processing) == int:
-                p = processing
-            else:
-                p = processing()
-            tasks.append(Task(id=i, p=p, s=s))
-        ids = list(range(task_count))
-        machines = []
-        for m in range(len(machineCounts)):
-            machines.append(Machine(ordering=ids[0:machineCounts[m]]))
-            ids = ids[machineCounts[m]:]
-        return Instance(tasks=tasks, machines=machines)
+        return Instance.from_arrays(draw(setups, task_count), draw(processing, task_count), machineCounts)
 
     @staticmethod
     def from_file(path):
@@ -115,18 +204,13 @@ class Instance:
             # Actual data
             [n, m] = list(map(int, f.readline().split()))
             machineCounts = list(map(int, f.readline().split()))
-            tasks = []
-            machines = []
-            for i in range(n):
-                [s, p] = list(map(int, f.readline().split()))
-                tasks.append(Task(id=i, s=s, p=p))
-            id = 0
-            for i in range(len(machineCounts)):
-                machines.append(Machine(id=i, ordering=list(range(id, id + machineCounts[i]))))
-                id = id + machineCounts[i]
-            return Instance(tasks=tasks, machines=machines)
+            times = np.loadtxt(f, dtype=np.int64, max_rows=n, ndmin=2).reshape(n, 2)
+            return Instance.from_arrays(times[:, 0].copy(), times[:, 1].copy(), machineCounts)
 
     def reorder(self):
+        # Array backed instances are always in machine order
+        if isinstance(self.tasks, Tasks):
+            return
         mapping = {}
         i = 0
         for machinei in range(len(self.machines)):
@@ -142,6 +226,7 @@ class Instance:
 
         self.tasks.sort(key=lambda t: t.id)
         self.machines.sort(key=lambda t: t.id)
+        self._arrays = None
 
     def to_file(self, path, comments=""):
         if isinstance(path, str):
@@ -153,6 +238,5 @@ class Instance:
         f.write("\n---------------\n")
         f.write(f"{len(self.tasks)} {len(self.machines)}\n")
         f.write(" ".join(map(lambda m: str(len(m.ordering)), self.machines)) + "\n")
-        for task in self.tasks:
-            f.write(f"{task.s} {task.p}\n")
+        f.write("".join(map("{} {}\n".format, self.arrays.s.tolist(), self.arrays.p.tolist())))
         f.close()
@@ -1,9 +1,87 @@
 from solver import *
+from evaluator import instance_arrays, predecessors
 
 
 class LOVSolver(Solver):
-    def __init__(self):
+    def __init__(self, lazy=False, fractional=False, max_cuts=None, matrix=False):
         super().__init__("lovsolver")
+        # Build the constraints as sparse matrices instead of expression by expression
+        self.matrix = matrix
+        # Separate the transitivity constraints in a callback instead of adding all n^3 of them
+        self.lazy = lazy
+        # Also separate them on fractional node relaxations
+        self.fractional = fractional
+        self.max_cuts = max_cuts
+
+    def options(self):
+        return {'lazy': self.lazy, 'fractional': self.fractional, 'max_cuts': self.max_cuts, 'matrix': self.matrix}
+
+    def get_model(self, relaxed=False) -> gp.Model:
+        if relaxed and self.lazy and self.relaxed_model is None:
+            # The relaxation is solved without callback, so it needs the transitivity constraints explicitly
+            model = super().get_model(True)
+            self.add_transitivity(model, self.get_variables(True).Delta)
+            return model
+        return super().get_model(relaxed)
+
+    # Delta values fixed by the machine orderings, -1 where the order is free
+    def fixed_order(self):
+        instance = self.get_instance()
+        fixed = np.full((len(instance.tasks), len(instance.tasks)), -1)
+        np.fill_diagonal(fixed, 0)
+        for machine in instance.machines:
+            fixed[np.ix_(machine.ordering, machine.ordering)] = np.triu(np.ones((len(machine), len(machine))), 1)
+        return fixed
+
+    def add_transitivity(self, model, Delta):
+        instance = self.get_instance()
+        if self.matrix:
+            n = len(instance.tasks)
+            i, j, k = map(np.ravel, np.indices((n, n, n)))
+            r = np.arange(n ** 3)
+            add_matrix_constraints(
+                model, list(Delta.values()),
+                np.concatenate((r, r, r)), np.concatenate((i * n + k, i * n + j, j * n + k)),
+                np.concatenate((np.ones(n ** 3), -np.ones(n ** 3), -np.ones(n ** 3))),
+                GRB.GREATER_EQUAL, -np.ones(n ** 3), name="Delta2")
+            return
+
+        model.addConstrs(
+            (Delta[i, k] >= Delta[i, j] + Delta[j, k] - 1
+             for i in range(len(instance.tasks))
+             for j in range(len(instance.tasks))
+             for k in range(len(instance.tasks))),
+            name="Delta2")
+
+    def transitivity_callback(self):
+        instance = self.get_instance()
+        Delta = self.get_variables().Delta
+        n = len(instance.tasks)
+        max_cuts = self.max_cuts or n
+        delta_vars = [Delta[i, j] for i in range(n) for j in range(n)]
+
+        # Triples (i, j, k) that can be violated: i, j, k distinct and not settled by the machine orderings
+        fixed = self.fixed_order()
+        needed = (fixed[:, :, None] != 0) & (fixed[None, :, :] != 0) & (fixed[:, None, :] != 1)
+        needed &= ~np.eye(n, dtype=bool)[:, :, None] & ~np.eye(n, dtype=bool)[None, :, :]
+        needed &= ~np.eye(n, dtype=bool)[:, None, :]
+
+        def add_cuts(model, values):
+            D = np.reshape(values, (n, n))
+            violation = np.where(needed, D[:, :, None] + D[None, :, :] - 1 - D[:, None, :], 0)
+            flat = np.flatnonzero(violation > 1e-6)
+            flat = flat[np.argsort(-violation.ravel()[flat])[:max_cuts]]
+            for i, j, k in zip(*np.unravel_index(flat, violation.shape)):
+                model.cbLazy(Delta[i, k] >= Delta[i, j] + Delta[j, k] - 1)
+
+        def callback(model, where):
+            if where == GRB.Callback.MIPSOL:
+                add_cuts(model, model.cbGetSolution(delta_vars))
+            elif self.fractional and where == GRB.Callback.MIPNODE:
+                if model.cbGet(GRB.Callback.MIPNODE_STATUS) == GRB.OPTIMAL:
+                    add_cuts(model, model.cbGetNodeRel(delta_vars))
+
+        return callback
 
     def add_variables(self):
         instance = self.get_instance()
@@ -13,9 +91,70 @@ class LOVSolver(Solver):
         variables.C_max = model.addVar(name="C_max", vtype=GRB.CONTINUOUS, lb=0)
         variables.C = model.addVars(len(instance.tasks), name="C", vtype=GRB.CONTINUOUS, lb=0)
         variables.Delta = model.addVars(len(instance.tasks), len(instance.tasks), name="delta", vtype=GRB.BINARY)
-        variables.L = sum(t.p + t.s for t in instance.tasks)
+        variables.L = instance.arrays.work.sum().item()
+
+    def add_matrix_constraints(self):
+        instance = self.get_instance()
+        model = self.get_model()
+        variables = self.get_variables()
+        n = len(instance.tasks)
+        s, p, _, _ = instance_arrays(instance)
+        pred = predecessors(instance)
+        L = variables.L
+
+        x = [variables.C_max] + list(variables.C.values()) + list(variables.Delta.values())
+        C = 1 + np.arange(n)
+        Delta = 1 + n + np.arange(n * n).reshape(n, n)
+        tasks = np.arange(n)
+
+        add_matrix_constraints(model, x, tasks, np.diag(Delta), np.ones(n), GRB.EQUAL, np.zeros(n), name="Delta0")
+
+        i, j = np.tril_indices(n, -1)
+        r = np.arange(len(i))
+        add_matrix_constraints(model, x, np.concatenate((r, r)), np.concatenate((Delta[i, j], Delta[j, i])),
+                               np.ones(2 * len(r)), GRB.EQUAL, np.ones(len(r)), name="Delta1")
+
+        if self.lazy:
+            model.setParam("LazyConstraints", 1)
+            self.callbacks.append(self.transitivity_callback())
+        else:
+            self.add_transitivity(model, variables.Delta)
+
+        before = np.concatenate([np.array(machine.ordering)[np.triu_indices(len(machine), 1)[0]]
+                                 for machine in instance.machines])
+        after = np.concatenate([np.array(machine.ordering)[np.triu_indices(len(machine), 1)[1]]
+                                for machine in instance.machines])
+        add_matrix_constraints(model, x, np.arange(len(before)), Delta[before, after], np.ones(len(before)),
+                               GRB.EQUAL, np.ones(len(before)), name="Initial")
+
+        # 25
+        later = tasks[pred >= 0]
+        add_matrix_constraints(
+            model, x,
+            np.concatenate((tasks, later)), np.concatenate((C, C[pred[later]])),
+            np.concatenate((np.ones(n), -np.ones(len(later)))),
+            GRB.GREATER_EQUAL, p + s, name="25")
+
+        # 26
+        j_0, j_1 = map(np.ravel, np.indices((n, n)))
+        r = np.arange(n * n)
+        add_matrix_constraints(
+            model, x,
+            np.concatenate((r, r, r)), np.concatenate((C[j_1], C[j_0], Delta[j_0, j_1])),
+            np.concatenate((np.ones(n * n), -np.ones(n * n), -L * np.ones(n * n))),
+            GRB.GREATER_EQUAL, p[j_1] + s[j_1] - p[j_0] - L, name="26")
+
+        # 27
+        add_matrix_constraints(model, x, np.concatenate((tasks, tasks)),
+                               np.concatenate((np.zeros(n, dtype=np.int64), C)),
+                               np.concatenate((np.ones(n), -np.ones(n))), GRB.GREATER_EQUAL, np.zeros(n), name="27")
+
+        model.setObjective(variables.C_max)
 
     def add_constraints(self):
+        if self.matrix:
+            return self.add_matrix_constraints()
+
         instance = self.get_instance()
         model = self.get_model()
         variables = self.get_variables()
@@ -24,6 +163,7 @@ class LOVSolver(Solver):
         C = variables.C
         Delta = variables.Delta
         L = variables.L
+        s, p = instance.arrays.s.tolist(), instance.arrays.p.tolist()
 
         model.addConstrs(
             (Delta[i, i] == 0 for i in range(len(instance.tasks))),
@@ -33,29 +173,28 @@ class LOVSolver(Solver):
             (Delta[i, j] + Delta[j, i] == 1 for i in range(len(instance.tasks)) for j in range(i)),
             name="Delta1")
 
-        model.addConstrs(
-            (Delta[i, k] >= Delta[i, j] + Delta[j, k] - 1
-             for i in range(len(instance.tasks))
-             for j in range(len(instance.tasks))
-             for k in range(len(instance.tasks))),
-            name="Delta2")
+        if self.lazy:
+            model.setParam("LazyConstraints", 1)
+            self.callbacks.append(self.transitivity_callback())
+        else:
+            self.add_transitivity(model, Delta)
 
         for machine in instance.machines:
             ordering = machine.ordering
             model.addConstrs(
                 (Delta[ordering[i], ordering[j]] == 1 for j in range(len(ordering)) for i in range(j)),
                 name=f"Initial[{machine.id}]")
-            model.addConstr((C[ordering[0]] >= instance.tasks[ordering[0]].p + instance.tasks[ordering[0]].s),
+            model.addConstr((C[ordering[0]] >= p[ordering[0]] + s[ordering[0]]),
                             name=f"25a[{machine.id}]")
             model.addConstrs(
-                (C[ordering[i]] >= instance.tasks[ordering[i]].p + instance.tasks[ordering[i]].s + C[ordering[i - 1]]
+                (C[ordering[i]] >= p[ordering[i]] + s[ordering[i]] + C[ordering[i - 1]]
                  for i in range(1, len(ordering))), name=f"25b[{machine.id}]"
             )
 
         # 26
         model.addConstrs(
             (C[j_1] + L * (1 - Delta[j_0, j_1]) >=
-             C[j_0] - instance.tasks[j_0].p + instance.tasks[j_1].p + instance.tasks[j_1].s
+             C[j_0] - p[j_0] + p[j_1] + s[j_1]
              for j_0 in range(len(instance.tasks))
              for j_1 in range(len(instance.tasks))),
             name="26"
@@ -66,26 +205,31 @@ class LOVSolver(Solver):
 
         model.setObjective(C_max)
 
-    def extract_solution(self, relaxed) -> Solution:
+    def set_start(self, solution: Solution):
         instance = self.get_instance()
-        variables = self.get_variables(relaxed)
+        variables = self.get_variables()
 
-        order = {}
+        position = {j: i for i, j in enumerate(solution.server_order)}
+        variables.C_max.Start = solution.makespan
+        for t in instance.tasks:
+            variables.C[t.id].Start = solution.task_times[t.id][1]
         for i in range(len(instance.tasks)):
-            ind = 0
             for j in range(len(instance.tasks)):
-                ind += variables.Delta[j, i].X
-            order[ind] = i
+                variables.Delta[i, j].Start = 1 if position[i] < position[j] else 0
 
-        order2 = list(map(lambda i: order[i], order))
+    def extract_solution(self, relaxed) -> Solution:
+        instance = self.get_instance()
+        variables = self.get_variables(relaxed)
+        n = len(instance.tasks)
+        s, p, _, _ = instance_arrays(instance)
 
-        task_times = {}
-        for t in instance.tasks:
-            task_times[t.id] = (variables.C[t.id].X - t.p - t.s, variables.C[t.id].X)
+        # The number of tasks before every task
+        before = self.get_values(variables.Delta, relaxed).reshape(n, n).sum(axis=0)
+        C = self.get_values(variables.C, relaxed)
 
         return Solution(
-            server_order=order2,
-            task_times=task_times,
+            server_order=np.argsort(before, kind="stable").tolist(),
+            task_times=dict(enumerate(zip((C - p - s).tolist(), C.tolist()))),
             makespan=variables.C_max.X,
             instance=instance
         )
@@ -1,10 +1,14 @@
 from instance import *
+from packed import LazyInstances, load
 
 
 def U(low, high):
     def inner():
         return np.random.randint(low, high+1)
     inner.name = f"U[{low}, {high}]"
+    # Bounds for drawing many values at once
+    inner.low = low
+    inner.high = high
     return inner
 
 
@@ -64,12 +68,18 @@ class InstanceSet:
     instances: list
 
 
+# Instances are loaded on first access from file.pack, which is packed again from the text files whenever they
+# changed (see packed.load), and else from the text files
 def read_config_instances(name, configs, file, n=10):
+    dataset = load(file)
+    if dataset is not None and len(dataset) != len(configs):
+        raise Exception(f"{file}.pack has {len(dataset)} configurations, expected {len(configs)}")
     lst = []
     for i in range(len(configs)):
-        instances = []
-        for j in range(n):
-            instances.append(Instance.from_file(file + f"_{i+1}_{j+1}.txt"))
+        if dataset is not None:
+            instances = dataset.instances(i, n)
+        else:
+            instances = LazyInstances(lambda j, i=i: Instance.from_file(file + f"_{i+1}_{j+1}.txt"), n)
         lst.append(InstanceSet(name=name, config=configs[i], instances=instances))
     return lst
 
@@ -80,3 +90,6 @@ instances_IIB = read_config_instances("IIB", configuration_IIB, "../dataset2b/da
 instances_IIIA = read_config_instances("IIIA", configuration_IIIA, "../dataset3a/data")
 instances_IIIB = read_config_instances("IIIB", configuration_IIIB, "../dataset3b/data")
 
+
+datasets = {instance_sets[0].name: instance_sets
+            for instance_sets in [instances_I, instances_IIA, instances_IIB, instances_IIIA, instances_IIIB]}
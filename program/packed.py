@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+from collections.abc import Sequence
+
+from instance import *
+
+magic = b"SSMJPACK"
+
+
+class LazyInstances(Sequence):
+    """
+    List of instances that are only loaded when they are first accessed.
+
+    A loaded instance is kept, so repeated accesses return the same object with the same uuid.
+    """
+
+    def __init__(self, load, n):
+        self.load = load
+        self.n = n
+        self.loaded = {}
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(self.n))]
+        if item < 0:
+            item += self.n
+        if not 0 <= item < self.n:
+            raise IndexError(item)
+        if item not in self.loaded:
+            self.loaded[item] = self.load(item)
+        return self.loaded[item]
+
+
+# Write the instance sets of a dataset to a single file of contiguous arrays:
+# s and p per task, machine_counts per machine, and the offsets of every instance (and set) into them.
+# Machines own consecutive task ids, as in the text format. sources is the fingerprint of the files packed.
+def pack(path, instance_sets, sources=None):
+    instances = [inst for instance_set in instance_sets for inst in instance_set]
+    for inst in instances:
+        inst.reorder()
+    arrays = {
+        's': np.array([t.s for inst in instances for t in inst.tasks], dtype=np.int32),
+        'p': np.array([t.p for inst in instances for t in inst.tasks], dtype=np.int32),
+        'machine_counts': np.array([len(m) for inst in instances for m in inst.machines], dtype=np.int32),
+        'task_offsets': np.cumsum([0] + [len(inst.tasks) for inst in instances], dtype=np.int64),
+        'machine_offsets': np.cumsum([0] + [len(inst.machines) for inst in instances], dtype=np.int64),
+        'set_offsets': np.cumsum([0] + [len(instance_set) for instance_set in instance_sets], dtype=np.int64),
+    }
+
+    header = {'sources': sources, 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [array.dtype.str, len(array), offset]
+        offset += array.nbytes
+    header = json.dumps(header).encode()
+    # Arrays start at a multiple of 8 bytes
+    start = -(-(len(magic) + 8 + len(header)) // 8) * 8
+    # Written next to the file and then moved over it, so that no process maps a partly written file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(magic + struct.pack("<Q", start))
+        f.write(header.ljust(start - len(magic) - 8))
+        for array in arrays.values():
+            f.write(array.tobytes())
+    os.replace(temporary, path)
+
+
+class PackedDataset:
+    """
+    Dataset file written by pack, with its arrays memory-mapped.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(magic)) != magic:
+                raise Exception(f"{path} is not a packed dataset")
+            start, = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(start - len(magic) - 8))
+        self.sources = header['sources']
+        for name, (dtype, n, offset) in header['arrays'].items():
+            array = np.memmap(path, dtype=np.dtype(dtype), mode="r", offset=start + offset, shape=(n,)) \
+                if n > 0 else np.zeros(0, dtype=dtype)
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.set_offsets) - 1
+
+    def instance(self, k) -> Instance:
+        t0, t1 = self.task_offsets[k], self.task_offsets[k + 1]
+        counts = self.machine_counts[self.machine_offsets[k]:self.machine_offsets[k + 1]]
+        # Plain arrays instead of views on the file, so that instances can be pickled
+        return Instance.from_arrays(np.array(self.s[t0:t1]), np.array(self.p[t0:t1]), counts)
+
+    # Lazily loaded instances of the i-th set, only its first n if given
+    def instances(self, i, n=None) -> LazyInstances:
+        first = int(self.set_offsets[i])
+        count = int(self.set_offsets[i + 1]) - first
+        if n is not None and n > count:
+            raise Exception(f"Set {i + 1} has {count} instances, expected {n}")
+        return LazyInstances(lambda j: self.instance(first + j), count if n is None else n)
+
+
+# Text files file_{i}_{j}.txt, by configuration i and instance j
+def text_files(file):
+    path = Path(file)
+    found = {}
+    for f in path.parent.glob(path.name + "_*_*.txt"):
+        i, j = map(int, re.fullmatch(re.escape(path.name) + r"_(\d+)_(\d+)\.txt", f.name).groups())
+        found.setdefault(i, {})[j] = f
+    return [[found[i][j] for j in sorted(found[i])] for i in sorted(found)]
+
+
+# Fingerprint of the text files of a dataset, from their names, sizes and modification times
+def fingerprint(files):
+    digest = hashlib.sha256()
+    for f in (f for instance_files in files for f in instance_files):
+        stat = f.stat()
+        digest.update(f"{f.name} {stat.st_size} {stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+# Convert the text files of a dataset to file.pack and check that every instance reads back the same
+def convert(file):
+    files = text_files(file)
+    instance_sets = [[Instance.from_file(f) for f in instance_files] for instance_files in files]
+    pack(file + ".pack", instance_sets, fingerprint(files))
+
+    dataset = PackedDataset(file + ".pack")
+    for i, instance_set in enumerate(instance_sets):
+        for j, (original, loaded) in enumerate(zip(instance_set, dataset.instances(i), strict=True)):
+            if original.encode()['tasks'] != loaded.encode()['tasks'] or \
+                    original.encode()['machines'] != loaded.encode()['machines']:
+                raise Exception(f"Instance {i + 1}_{j + 1} of {file} does not read back the same")
+    print(f"Packed {sum(map(len, instance_sets))} instances to {file}.pack")
+
+
+# The packed dataset of the text files of file, packed again when file.pack is missing or was packed from other
+# versions of the text files. None if there are neither text files nor file.pack.
+def load(file) -> PackedDataset:
+    path = file + ".pack"
+    files = text_files(file)
+    if len(files) == 0:
+        return PackedDataset(path) if Path(path).exists() else None
+    if not Path(path).exists() or PackedDataset(path).sources != fingerprint(files):
+        convert(file)
+    return PackedDataset(path)
+
+
+if __name__ == '__main__':
+    for file in sys.argv[1:] or ["../dataset1/data", "../dataset2a/data", "../dataset2b/data",
+                                 "../dataset3a/data", "../dataset3b/data"]:
+        convert(file)
@@ -0,0 +1,150 @@
+from solver import *
+from positionsolver import PositionSolver
+from lovsolver import LOVSolver
+from tivsolver import TIVSolver
+from heuristic import HeuristicSolver
+
+
+class Race:
+    """
+    Best incumbent and bound over the solvers of a race, shared through their callbacks.
+
+    The race is over once a solver proves its incumbent optimal, or once the best bound of any solver meets the best
+    incumbent of any solver, which proves that incumbent optimal even if no single solver could.
+    """
+
+    def __init__(self, gap=1e-4):
+        self.gap = gap
+        self.lock = Lock()
+        self.incumbent = float('inf')
+        self.holder = None
+        self.bound = -float('inf')
+        self.winner = None
+
+    def update(self, name, incumbent=None, bound=None):
+        with self.lock:
+            if incumbent is not None and incumbent < self.incumbent:
+                self.incumbent = incumbent
+                self.holder = name
+            if bound is not None and bound > self.bound:
+                self.bound = bound
+
+    def finish(self, name):
+        with self.lock:
+            if self.winner is None:
+                self.winner = name
+
+    def over(self):
+        return self.winner is not None or self.incumbent - self.bound <= max(delta, self.gap * abs(self.incumbent))
+
+    # Observer of a solver that shares its progress and stops it once the race is over
+    def observer(self, name, solver: Solver):
+        def callback(model, where):
+            if where == GRB.Callback.MIP:
+                self.update(name,
+                            incumbent=model.cbGet(GRB.Callback.MIP_OBJBST) * solver.time_unit(),
+                            bound=model.cbGet(GRB.Callback.MIP_OBJBND) * solver.time_unit())
+            if self.over():
+                model.terminate()
+        return callback
+
+
+class PortfolioSolver(Solver):
+    """
+    Races several formulations on the same instance, each in its own thread with its own Gurobi environment, and
+    returns the first optimal solution found.
+
+    All formulations are warm started from the heuristic, so they share its makespan as cutoff.
+    """
+
+    def __init__(self, solvers=None, threads=1, warm_start=True):
+        super().__init__('portfolio')
+        self.solvers = solvers or {'piv': PositionSolver(), 'lov': LOVSolver(), 'tiv': TIVSolver()}
+        # Gurobi threads of the whole portfolio, split over the formulations
+        self.threads = threads
+        self.warm_start = warm_start
+        self.envs = None
+
+    def reset(self):
+        super().reset()
+        self.race = None
+        self.errors = {}
+
+    # The portfolio builds no model of its own
+    def add_variables(self):
+        pass
+
+    def add_constraints(self):
+        pass
+
+    def extract_solution(self, relaxed) -> Solution:
+        return self.get_solution(relaxed)
+
+    # Every formulation runs at the same time, with at least one thread each
+    def formulation_threads(self):
+        return max(1, self.threads // len(self.solvers))
+
+    # Cores the portfolio keeps busy
+    def cores(self):
+        return self.formulation_threads() * len(self.solvers)
+
+    def get_envs(self):
+        if self.envs is None:
+            self.envs = {}
+            for name in self.solvers:
+                env = gp.Env(empty=True)
+                env.setParam("Threads", self.formulation_threads())
+                env.setParam("OutputFlag", 0)
+                env.start()
+                self.envs[name] = env
+        return self.envs
+
+    def run(self, name, solver: Solver, instance: Instance, start):
+        observer = self.race.observer(name, solver)
+        solver.observers.append(observer)
+        try:
+            solver.solve(instance, relaxed=False, start=start)
+            if solver.get_model().status == GRB.OPTIMAL:
+                self.race.finish(name)
+        except Exception as e:
+            self.errors[name] = e
+        finally:
+            solver.observers.remove(observer)
+
+    def solve(self, instance: Instance, standard=True, relaxed=False, start=None):
+        self.reset()
+        self.instance = instance
+        self.race = Race()
+        wall = time.perf_counter()
+
+        if start is None and self.warm_start:
+            start = HeuristicSolver().solve(instance)
+        if start is not None:
+            self.race.update('heuristic', incumbent=start.makespan)
+
+        # The environments are created up front, Gurobi does not share one between threads
+        for name, env in self.get_envs().items():
+            self.solvers[name].env = env
+        threads = [Thread(target=self.run, args=(name, solver, instance, start))
+                   for name, solver in self.solvers.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if not self.race.over():
+            raise Exception(f"No formulation solved the instance: {self.errors}")
+
+        # Without a single winner the best bound proved the best incumbent optimal
+        name = self.race.winner or self.race.holder
+        if name == 'heuristic':
+            self.solution = start
+        else:
+            solver = self.solvers[name]
+            if solver.solution is None:
+                solver.solution = solver.extract_solution(False)
+            self.solution = solver.solution
+        self.solution.solve_time = time.perf_counter() - wall
+        self.solution.bound = self.race.bound if self.race.winner is None else self.solution.bound
+        self.solution.method = name
+        return self.solution
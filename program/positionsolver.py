@@ -1,9 +1,33 @@
 from solver import *
+from evaluator import heads_tails, instance_arrays, predecessors
+from heuristic import HeuristicSolver
 
 
 class PositionSolver(Solver):
-    def __init__(self):
+    def __init__(self, sparse=False, lazy=False, matrix=False):
         super().__init__('posmodel')
+        # Build the constraints as sparse matrices instead of expression by expression
+        self.matrix = matrix
+        # Skip constraint 26 for pairs ordered by the machine sequences and use per pair big-M values
+        self.sparse = sparse
+        # Add constraint 26 rows in a callback when an integer solution violates them
+        self.lazy = lazy
+
+    def options(self):
+        return {'sparse': self.sparse, 'lazy': self.lazy, 'matrix': self.matrix}
+
+    # Bounds the model was built on, stored with the solutions: the sparse model takes its big-M values and bounds on
+    # C from the heuristic makespan, which also tightens the LP relaxation
+    def variant(self):
+        return f"{'heuristic' if self.sparse else 'serial'} bounds"
+
+    def get_model(self, relaxed=False) -> gp.Model:
+        if relaxed and self.lazy and self.relaxed_model is None:
+            # The relaxation is solved without callback, so it needs constraint 26 explicitly
+            model = super().get_model(True)
+            self.add_sequencing(model, self.get_variables(True))
+            return model
+        return super().get_model(relaxed)
 
     def add_variables(self):
         instance = self.get_instance()
@@ -14,16 +38,165 @@ class PositionSolver(Solver):
         variables.C = model.addVars(len(instance.tasks), name="C", vtype=GRB.CONTINUOUS, lb=0)
         variables.Y = model.addVars(len(instance.tasks), len(instance.tasks), name="y", vtype=GRB.BINARY)
 
-    def add_constraints(self):
+        if self.sparse:
+            # Only schedules at least as good as the heuristic one are needed
+            variables.UB = HeuristicSolver().solve(instance).makespan
+            head, tail = heads_tails(instance)
+            variables.C_max.UB = variables.UB
+            for t in instance.tasks:
+                variables.C[t.id].LB = head[t.id] + t.s + t.p
+                variables.C[t.id].UB = variables.UB - tail[t.id]
+        variables.M = self.big_m()
+
+    # Big-M of the constraint 26 rows for every pair (j_0, j_1) that needs them
+    def big_m(self):
+        instance = self.get_instance()
+        variables = self.get_variables()
+        n = len(instance.tasks)
+
+        if not self.sparse:
+            L = instance.arrays.work.sum().item()
+            return {(j_0, j_1): L for j_0 in range(n) for j_1 in range(n)}
+
+        head, tail = heads_tails(instance)
+        _, p, machine, _ = instance_arrays(instance)
+        # Largest violation of C[j_1] >= C[j_0] - p_0 + p_1 + s_1 within the bounds on C
+        m = variables.UB - (tail + p)[:, None] - head[None, :]
+        # Tasks of one machine are sequenced by constraint 25 and the order rows
+        keep = (machine[:, None] != machine[None, :]) & (m > 0)
+        j_0, j_1 = np.nonzero(keep)
+        return dict(zip(zip(j_0.tolist(), j_1.tolist()), m[keep].tolist()))
+
+    def add_sequencing(self, model, variables):
+        if self.matrix:
+            return self.add_matrix_sequencing(model, variables)
+
+        instance = self.get_instance()
+        s, p = instance.arrays.s.tolist(), instance.arrays.p.tolist()
+        C = variables.C
+        Y = variables.Y
+        M = variables.M
+
+        # 26
+        model.addConstrs(
+            (C[j_1] + M[j_0, j_1] * (2 - Y[j_0, i - 1] - Y[j_1, i]) >=
+             C[j_0] - p[j_0] + p[j_1] + s[j_1]
+             for j_0, j_1 in M
+             for i in range(1, len(instance.tasks))),
+            name="26"
+        )
+
+    def add_matrix_sequencing(self, model, variables):
+        instance = self.get_instance()
+        n = len(instance.tasks)
+        s, p, _, _ = instance_arrays(instance)
+        x = list(variables.C.values()) + list(variables.Y.values())
+        C = np.arange(n)
+        Y = n + np.arange(n * n).reshape(n, n)
+
+        pairs = np.array(list(variables.M.keys()), dtype=np.int64).reshape(-1, 2)
+        j_0 = np.repeat(pairs[:, 0], n - 1)
+        j_1 = np.repeat(pairs[:, 1], n - 1)
+        M = np.repeat(np.array(list(variables.M.values()), dtype=float), n - 1)
+        i = np.tile(np.arange(1, n), len(pairs))
+        r = np.arange(len(i))
+
+        # 26
+        add_matrix_constraints(
+            model, x,
+            np.concatenate((r, r, r, r)),
+            np.concatenate((C[j_1], C[j_0], Y[j_0, i - 1], Y[j_1, i])),
+            np.concatenate((np.ones(len(r)), -np.ones(len(r)), -M, -M)),
+            GRB.GREATER_EQUAL, p[j_1] + s[j_1] - p[j_0] - 2 * M, name="26")
+
+    def add_matrix_constraints(self):
         instance = self.get_instance()
         model = self.get_model()
         variables = self.get_variables()
+        n = len(instance.tasks)
+        s, p, _, _ = instance_arrays(instance)
+        pred = predecessors(instance)
+
+        x = [variables.C_max] + list(variables.C.values()) + list(variables.Y.values())
+        C = 1 + np.arange(n)
+        Y = 1 + n + np.arange(n * n).reshape(n, n)
+        tasks = np.arange(n)
+
+        # 22
+        add_matrix_constraints(model, x, np.repeat(tasks, n), Y.T.ravel(), np.ones(n * n),
+                               GRB.EQUAL, np.ones(n), name="22")
+
+        # 23
+        add_matrix_constraints(model, x, np.repeat(tasks, n), Y.ravel(), np.ones(n * n),
+                               GRB.EQUAL, np.ones(n), name="23")
 
-        L = sum(t.p + t.s for t in instance.tasks)
+        # 25
+        later = tasks[pred >= 0]
+        add_matrix_constraints(
+            model, x,
+            np.concatenate((tasks, later)), np.concatenate((C, C[pred[later]])),
+            np.concatenate((np.ones(n), -np.ones(len(later)))),
+            GRB.GREATER_EQUAL, p + s, name="25")
+
+        if self.sparse:
+            # The server visits the tasks of a machine in machine order
+            r = np.repeat(np.arange(len(later)), n)
+            i = np.tile(np.arange(n), len(later))
+            add_matrix_constraints(
+                model, x,
+                np.concatenate((r, r)),
+                np.concatenate((Y[np.repeat(pred[later], n), i], Y[np.repeat(later, n), i])),
+                np.concatenate((i, -i)),
+                GRB.LESS_EQUAL, -np.ones(len(later)), name="order")
+
+        if self.lazy:
+            model.setParam("LazyConstraints", 1)
+            self.callbacks.append(self.sequencing_callback())
+        else:
+            self.add_sequencing(model, variables)
+
+        # 27
+        add_matrix_constraints(model, x, np.concatenate((tasks, tasks)),
+                               np.concatenate((np.zeros(n, dtype=np.int64), C)),
+                               np.concatenate((np.ones(n), -np.ones(n))), GRB.GREATER_EQUAL, np.zeros(n), name="27")
+
+        # objective
+        model.setObjective(variables.C_max)
+
+    def sequencing_callback(self):
+        instance = self.get_instance()
+        variables = self.get_variables()
+        n = len(instance.tasks)
+        s, p = instance.arrays.s.tolist(), instance.arrays.p.tolist()
+        C, Y, M = variables.C, variables.Y, variables.M
+        y_vars = [Y[j, i] for j in range(n) for i in range(n)]
+        c_vars = [C[j] for j in range(n)]
+
+        def callback(model, where):
+            if where != GRB.Callback.MIPSOL:
+                return
+            order = np.argmax(np.reshape(model.cbGetSolution(y_vars), (n, n)), axis=0)
+            c = model.cbGetSolution(c_vars)
+            for i in range(1, n):
+                j_0, j_1 = int(order[i - 1]), int(order[i])
+                if (j_0, j_1) in M and c[j_1] < c[j_0] - p[j_0] + p[j_1] + s[j_1] - delta:
+                    model.cbLazy(C[j_1] + M[j_0, j_1] * (2 - Y[j_0, i - 1] - Y[j_1, i]) >=
+                                 C[j_0] - p[j_0] + p[j_1] + s[j_1])
+
+        return callback
+
+    def add_constraints(self):
+        if self.matrix:
+            return self.add_matrix_constraints()
+
+        instance = self.get_instance()
+        model = self.get_model()
+        variables = self.get_variables()
 
         C_max = variables.C_max
         C = variables.C
         Y = variables.Y
+        s, p = instance.arrays.s.tolist(), instance.arrays.p.tolist()
 
         # 22
         model.addConstrs(
@@ -38,22 +211,26 @@ class PositionSolver(Solver):
         # 25
         for machine in instance.machines:
             ordering = machine.ordering
-            model.addConstr((C[ordering[0]] >= instance.tasks[ordering[0]].p + instance.tasks[ordering[0]].s),
+            model.addConstr((C[ordering[0]] >= p[ordering[0]] + s[ordering[0]]),
                             name=f"25a[{machine.id}]")
             model.addConstrs(
-                (C[ordering[i]] >= instance.tasks[ordering[i]].p + instance.tasks[ordering[i]].s + C[ordering[i - 1]]
+                (C[ordering[i]] >= p[ordering[i]] + s[ordering[i]] + C[ordering[i - 1]]
                  for i in range(1, len(ordering))), name=f"25b[{machine.id}]"
             )
 
-        # 26
-        model.addConstrs(
-            (C[j_1] + L * (2 - Y[j_0, i - 1] - Y[j_1, i]) >=
-             C[j_0] - instance.tasks[j_0].p + instance.tasks[j_1].p + instance.tasks[j_1].s
-             for j_0 in range(len(instance.tasks))
-             for j_1 in range(len(instance.tasks))
-             for i in range(1, len(instance.tasks))),
-            name="26"
-        )
+        if self.sparse:
+            # The server visits the tasks of a machine in machine order
+            model.addConstrs(
+                (gp.quicksum(i * Y[machine.ordering[k - 1], i] for i in range(len(instance.tasks))) + 1 <=
+                 gp.quicksum(i * Y[machine.ordering[k], i] for i in range(len(instance.tasks)))
+                 for machine in instance.machines for k in range(1, len(machine))),
+                name="order")
+
+        if self.lazy:
+            model.setParam("LazyConstraints", 1)
+            self.callbacks.append(self.sequencing_callback())
+        else:
+            self.add_sequencing(model, variables)
 
         # 27
         model.addConstrs((C_max >= C[i] for i in range(len(instance.tasks))), name="27")
@@ -61,27 +238,34 @@ class PositionSolver(Solver):
         # objective
         model.setObjective(C_max)
 
+    def set_start(self, solution: Solution):
+        instance = self.get_instance()
+        variables = self.get_variables()
+
+        variables.C_max.Start = solution.makespan
+        for t in instance.tasks:
+            variables.C[t.id].Start = solution.task_times[t.id][1]
+        for i in range(len(instance.tasks)):
+            for j in range(len(instance.tasks)):
+                variables.Y[j, i].Start = 1 if solution.server_order[i] == j else 0
+
     def extract_solution(self, relaxed) -> Solution:
         instance = self.get_instance()
         variables = self.get_variables(relaxed)
+        n = len(instance.tasks)
+        s, p, _, _ = instance_arrays(instance)
 
+        C = self.get_values(variables.C, relaxed)
         if not relaxed:
-            order = [0 for i in range(len(instance.tasks))]
-            for i in range(len(instance.tasks)):
-                for j in range(len(instance.tasks)):
-                    if variables.Y[j, i].X > 0.5:
-                        order[i] = j
-
-            task_times = {}
-            for t in instance.tasks:
-                task_times[t.id] = (variables.C[t.id].X - t.p - t.s, variables.C[t.id].X)
+            order = np.argmax(self.get_values(variables.Y, relaxed).reshape(n, n), axis=0)
         else:
-            order = []
-            task_times = []
+            # Fractional positions do not give an order, use the relaxed start times instead
+            order = np.argsort(C - p - s, kind="stable")
 
         return Solution(
-            server_order=order,
-            task_times=task_times,
+            server_order=order.tolist(),
+            task_times=dict(enumerate(zip((C - p - s).tolist(), C.tolist()))),
             makespan=variables.C_max.X,
+            method=self.variant(),
             instance=instance
         )
@@ -0,0 +1,277 @@
+import argparse
+import json
+
+from sqlalchemy import create_engine, inspect, select, MetaData, Table
+
+import myinstances as data
+from solver import *
+from positionsolver import PositionSolver
+from lovsolver import LOVSolver
+from tivsolver import TIVSolver
+from heuristic import HeuristicSolver
+
+# Memory a model takes to build expression by expression, Python objects included, measured on PIV, LOV and TIV
+# models of up to 4 * 10^6 nonzeros
+bytes_per_var = 800
+bytes_per_constr = 450
+bytes_per_nonzero = 10
+
+
+@dataclass
+class Estimate:
+    formulation: str
+    vars: int
+    constrs: int
+    nonzeros: int
+    memory: float  # MB to build the model
+    work: float = None  # predicted Gurobi work of the solve, if the selector has learned a runtime model
+
+    def fits(self, budget):
+        return budget is None or self.memory <= budget
+
+
+# Size of the model a solver would build for an instance, from the structure of its formulation and without building
+# anything. Counts follow the builders, including the terms Gurobi drops because they cancel.
+def estimate(name, solver: Solver, instance: Instance) -> Estimate:
+    arrays = instance.arrays
+    n = len(arrays.s)
+    m = len(arrays.machine_offsets) - 1
+    counts = np.diff(arrays.machine_offsets).astype(np.int64)
+    # Rows of constraint 25 with a machine predecessor
+    later = n - m
+
+    if isinstance(solver, PositionSolver):
+        variables = 1 + n + n * n
+        # 22, 23, 25 and 27
+        constrs = 4 * n
+        nonzeros = 2 * n * n + n + later + 2 * n
+        if solver.sparse:
+            # At most every pair of tasks on different machines needs constraint 26
+            pairs = n * n - int((counts ** 2).sum())
+            constrs += later
+            nonzeros += later * 2 * (n - 1)
+            rows, row_nonzeros = pairs * (n - 1), 4 * pairs * (n - 1)
+        else:
+            # Pairs of a task with itself lose both C terms
+            rows, row_nonzeros = n * n * (n - 1), 4 * n * n * (n - 1) - 2 * n * (n - 1)
+        if not solver.lazy:
+            constrs += rows
+            nonzeros += row_nonzeros
+    elif isinstance(solver, LOVSolver):
+        variables = 1 + n + n * n
+        initial = int((counts * (counts - 1) // 2).sum())
+        # Delta0, Delta1, Initial, 25, 26 and 27
+        constrs = n + n * (n - 1) // 2 + initial + n + n * n + n
+        nonzeros = n + n * (n - 1) + initial + n + later + 3 * n * n - 2 * n + 2 * n
+        if not solver.lazy:
+            # Delta2, triples with repeated tasks lose the terms that cancel
+            constrs += n ** 3
+            nonzeros += 3 * n ** 3 - 4 * n * n + 2 * n
+    elif isinstance(solver, TIVSolver):
+        # The time horizon and windows of the builder, which only take the heuristic
+        tiv = type(solver)(tighten=solver.tighten, scale=solver.scale)
+        tiv.instance = instance
+        grid = tiv.get_grid()
+        T = int(round(HeuristicSolver().solve(grid).makespan)) if tiv.tighten else int(grid.arrays.work.sum())
+        sizes = np.array([len(w) for w in tiv.start_windows(T).values()], dtype=np.int64)
+        W = int(sizes.sum())
+        variables = 1 + W
+        # cmax and all_scheduled, at most one single_server row per time step, and Ordering
+        constrs = 2 * n + T + later
+        nonzeros = W + n + W + int((grid.arrays.s.astype(np.int64) * sizes).sum()) + 2 * W
+    else:
+        raise Exception(f"Cannot estimate the size of a {type(solver).__name__} model")
+
+    memory = (bytes_per_var * variables + bytes_per_constr * constrs + bytes_per_nonzero * nonzeros) / 2 ** 20
+    return Estimate(name, variables, constrs, nonzeros, memory)
+
+
+class Selector:
+    """
+    Routes an instance to the formulation that is predicted to solve it fastest, among those whose model fits in the
+    memory budget (in MB, None for no budget).
+
+    Without a learned runtime model the smallest model, by nonzeros, is taken as the fastest. learn fits a power law
+    runtime = exp(a) * nonzeros^b per formulation to earlier results, in Gurobi work units.
+    """
+
+    def __init__(self, solvers=None, memory_budget=None, runtimes=None):
+        self.solvers = solvers or {'piv': PositionSolver(), 'lov': LOVSolver(), 'tiv': TIVSolver()}
+        self.memory_budget = memory_budget
+        # Formulation -> (a, b) of its runtime model
+        self.runtimes = runtimes or {}
+
+    def predict(self, e: Estimate):
+        if e.formulation in self.runtimes:
+            a, b = self.runtimes[e.formulation]
+            e.work = float(np.exp(a) * max(e.nonzeros, 1) ** b)
+        return e
+
+    def estimates(self, instance: Instance):
+        return [self.predict(estimate(name, solver, instance)) for name, solver in self.solvers.items()]
+
+    def cost(self, e: Estimate):
+        # Formulations without runtime model come after those with one
+        return (0, e.work) if self.runtimes and e.work is not None else (1, e.nonzeros)
+
+    def select(self, instance: Instance, estimates=None) -> Estimate:
+        estimates = estimates or self.estimates(instance)
+        feasible = [e for e in estimates if e.fits(self.memory_budget)]
+        if len(feasible) == 0:
+            sizes = ", ".join(f"{e.formulation} {e.memory:.1f} MB" for e in estimates)
+            raise Exception(f"No formulation fits in the memory budget of {self.memory_budget:g} MB "
+                            f"for {len(instance.tasks)} tasks: {sizes}")
+        return min(feasible, key=self.cost)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({'runtimes': self.runtimes}, f, indent=1)
+
+    @staticmethod
+    def load(path, solvers=None, memory_budget=None):
+        with open(path) as f:
+            runtimes = {name: tuple(ab) for name, ab in json.load(f)['runtimes'].items()}
+        return Selector(solvers, memory_budget, runtimes)
+
+    # Fit the runtime models, in Gurobi work units like the runtime columns, to the results databases of earlier
+    # campaigns. Runs that did not finish, while another formulation did, count as taking the work they reached
+    # before they stopped, as recorded in the runs table, and are left out where it was not recorded. Returns the
+    # fraction of the instances with several formulations run on which the fitted models pick the formulation that
+    # was fastest.
+    def learn(self, paths):
+        cells = []
+        for path in paths:
+            engine = create_engine(f'sqlite:///{path}')
+            if not inspect(engine).has_table('results'):
+                raise Exception(f"{path} has no results table")
+            results = Table('results', MetaData(), autoload_with=engine)
+            with engine.connect() as conn:
+                rows = conn.execute(select(results)).all()
+            # Older databases have no runs table
+            reached = {}
+            if inspect(engine).has_table('runs'):
+                runs = Table('runs', MetaData(), autoload_with=engine)
+                with engine.connect() as conn:
+                    for run in conn.execute(select(runs.c.dataset, runs.c.configuration, runs.c.instance,
+                                                   runs.c.method, runs.c.work)):
+                        reached[run.dataset, run.configuration, run.instance, run.method] = run.work
+            # Formulations that were not run on a dataset at all are left out for it
+            ran = {(row.dataset, name) for row in rows for name in self.solvers
+                   if getattr(row, f'runtime_{name}', None) is not None}
+            for row in rows:
+                runtimes = {name: getattr(row, f'runtime_{name}', None) for name in self.solvers
+                            if (row.dataset, name) in ran}
+                if all(r is None for r in runtimes.values()):
+                    continue
+                censored = {name: reached.get((row.dataset, row.configuration, row.instance, name))
+                            for name, r in runtimes.items() if r is None}
+                # Older databases name the datasets II.A, ...
+                instance = data.datasets[row.dataset.replace(".", "")][row.configuration].instances[row.instance - 1]
+                cells.append((instance, self.estimates(instance), runtimes, censored))
+
+        self.runtimes = {}
+        for name in self.solvers:
+            xy = [(e.nonzeros, runtimes[name] if runtimes[name] is not None else censored[name])
+                  for _, estimates, runtimes, censored in cells if name in runtimes
+                  for e in estimates if e.formulation == name]
+            xy = [(x, y) for x, y in xy if y is not None]
+            x, y = np.log(np.maximum(np.array(xy, dtype=float).reshape(-1, 2), 1e-6)).T
+            if len(np.unique(x)) >= 2:
+                b, a = np.polyfit(x, y, 1)
+                self.runtimes[name] = (float(a), float(b))
+
+        # Only instances on which several formulations were run tell whether the models pick the right one
+        hits = []
+        for instance, estimates, runtimes, _ in cells:
+            if len(runtimes) < 2:
+                continue
+            finished = {name: r for name, r in runtimes.items() if r is not None}
+            choice = self.select(instance, [self.predict(e) for e in estimates if e.formulation in runtimes])
+            hits.append(choice.formulation == min(finished, key=finished.get))
+        return sum(hits) / len(hits) if hits else float('NaN')
+
+
+class AutoSolver(Solver):
+    """
+    Solves every instance with the formulation its selector routes it to.
+    """
+
+    def __init__(self, selector: Selector = None):
+        super().__init__('auto')
+        self.selector = selector or Selector()
+
+    def reset(self):
+        super().reset()
+        self.estimate = None
+        self.chosen = None
+
+    # The chosen solver builds its own model
+    def add_variables(self):
+        pass
+
+    def add_constraints(self):
+        pass
+
+    def extract_solution(self, relaxed) -> Solution:
+        return self.get_solution(relaxed)
+
+    def get_profile(self) -> Profile:
+        return self.chosen.get_profile() if self.chosen is not None else super().get_profile()
+
+    def solve(self, instance: Instance, standard=True, relaxed=False, start=None):
+        self.reset()
+        self.instance = instance
+        self.estimate = self.selector.select(instance)
+        name = self.estimate.formulation
+        self.chosen = self.selector.solvers[name]
+        for setting in ['params', 'cache', 'shared_relaxation', 'profile_python', 'check_solutions',
+                        'record_interval', 'observers']:
+            setattr(self.chosen, setting, getattr(self, setting))
+
+        self.chosen.solve(instance, standard, relaxed, start)
+        self.model = self.chosen.model
+        self.record = self.chosen.record
+        self.build_time = self.chosen.build_time
+        self.relax_time = self.chosen.relax_time
+        self.solution = self.chosen.solution
+        self.relaxed_solution = self.chosen.relaxed_solution
+        if self.solution is not None:
+            self.solution.method = name
+        return self.solution
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Estimate model sizes and route instances to formulations")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    learn = subparsers.add_parser('learn', help="Fit the runtime models to results databases")
+    learn.add_argument('databases', nargs='*', default=["../db/results_1.db", "../db/results_23.db"])
+    learn.add_argument('--out', default="../db/selector.json")
+    route = subparsers.add_parser('route', help="Estimate the models of instances and pick a formulation")
+    route.add_argument('--datasets', nargs='+', default=['I'], choices=list(data.datasets))
+    route.add_argument('--instances', type=int, nargs='+', default=[1], help="1-based")
+    route.add_argument('--selector', help="Runtime models written by learn")
+    route.add_argument('--memory-budget', type=float, help="MB a model may take")
+    args = parser.parse_args()
+
+    if args.command == 'learn':
+        selector = Selector()
+        accuracy = selector.learn(args.databases)
+        for name, (a, b) in selector.runtimes.items():
+            print(f"{name}: work = {np.exp(a):.3g} * nonzeros^{b:.3f}")
+        print(f"Picks the fastest formulation on {accuracy:.0%} of the instances")
+        selector.save(args.out)
+    else:
+        selector = Selector.load(args.selector, memory_budget=args.memory_budget) if args.selector else \
+            Selector(memory_budget=args.memory_budget)
+        for name in args.datasets:
+            for c, instance_set in enumerate(data.datasets[name]):
+                for i in args.instances:
+                    instance = instance_set.instances[i - 1]
+                    estimates = selector.estimates(instance)
+                    try:
+                        choice = selector.select(instance, estimates).formulation
+                    except Exception as error:
+                        choice = str(error)
+                    sizes = ", ".join(f"{e.formulation} {e.nonzeros} nz {e.memory:.0f} MB" +
+                                      (f" {e.work:.1f} work" if e.work is not None else "") for e in estimates)
+                    print(f"{name} {c + 1}_{i}: {sizes} -> {choice}")
@@ -1,19 +1,37 @@
+import cProfile
+import io
+import pstats
+import sys
 import time
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from types import SimpleNamespace
 from threading import Thread, Lock
 
-from numpy.testing import assert_almost_equal
-
 from instance import *
 
 import gurobipy as gp
 from gurobipy import GRB
 from abc import ABC, abstractmethod
 import numpy as np
+import scipy.sparse as sp
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not profiled
+    resource = None
 
 delta = 1e-4
 
+
+# Add the rows A x (sense) rhs, with A given by its nonzero entries
+def add_matrix_constraints(model, x, rows, cols, vals, sense, rhs, name=""):
+    rhs = np.asarray(rhs, dtype=float)
+    A = sp.csr_matrix((np.asarray(vals, dtype=float), (rows, cols)), shape=(len(rhs), len(x)))
+    return model.addMConstr(A, x, sense, rhs, name=name)
+
+
 @dataclass
 class Solution:
     server_order: list
@@ -21,6 +39,7 @@ class Solution:
     makespan: float
     solve_time: float = None
     method: str = None
+    bound: float = None  # best lower bound on the makespan proven by the solver
     uuid: UUID = None
     instance: Instance = None
 
@@ -53,30 +72,58 @@ class Solution:
             'uuid': str(self.uuid)
         }
 
-    def verify(self):
+    # Report of the violations of the solution, see evaluator.verify
+    def verify(self, relaxed=False):
+        from evaluator import verify
+
         if self.instance is None:
             raise Exception("Cannot verify without instance")
+        return verify(self.instance, self, relaxed)
+
+
+@dataclass
+class SolveRecord:
+    status: int  # Gurobi status of the MIP solve
+    incumbent: float  # best makespan found, inf if none
+    bound: float  # best lower bound on the makespan
+    gap: float  # relative gap between the two, inf without incumbent
+    work: float
+    nodes: float
+    trajectory: np.ndarray  # rows of (wall time, work, incumbent, bound, nodes) during the solve
+
+    # Wall time at which the incumbent first reached the target makespan, inf if it never did
+    def time_to_target(self, target):
+        reached = np.flatnonzero(self.trajectory[:, 2] <= target + delta)
+        return self.trajectory[reached[0], 0] if len(reached) > 0 else float('inf')
+
+
+# Peak resident memory of the process so far in MB
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+@dataclass
+class Profile:
+    phases: dict = field(default_factory=dict)  # phase name -> [seconds, peak RSS in MB when it ended]
+    model: dict = field(default_factory=dict)  # size of the MIP model, and what the formulation adds about it
+    python: str = None  # cProfile statistics of the Python side phases, if they were profiled
+    relaxation: dict = None  # setup seconds, wall time and work of the LP relaxation, if it was solved
 
-        # Verify all tasks are scheduled exactly once
-        assert len(self.server_order) == len(self.instance.tasks)
-        assert len(self.server_order) == len(set(self.server_order) & set(map(lambda t: t.id, self.instance.tasks)))
+    def add(self, name, seconds, rss):
+        if name in self.phases:
+            seconds += self.phases[name][0]
+        self.phases[name] = [seconds, rss]
 
-        # Verify task times match
-        for t in self.instance.tasks:
-            assert_almost_equal(self.task_times[t.id][1], self.task_times[t.id][0] + t.p + t.s)
+    def seconds(self, *names):
+        return sum(self.phases[name][0] for name in names if name in self.phases)
 
-        # Verify server ordering
-        for i in range(1, len(self.server_order)):
-            j1 = self.instance.tasks[self.server_order[i-1]]
-            j2 = self.instance.tasks[self.server_order[i]]
-            assert self.task_times[j1.id][0] + j1.s <= self.task_times[j2.id][0] + delta
+    def encode(self):
+        return {'phases': self.phases, 'model': self.model, 'python': self.python, 'relaxation': self.relaxation}
 
-        # Verify machine orderings
-        for m in self.instance.machines:
-            for i in range(1, len(m.ordering)):
-                j1 = m[i - 1]
-                j2 = m[i]
-                assert self.task_times[j1.id][1] <= self.task_times[j2.id][0] + delta
 
 class Solver(ABC):
 
@@ -88,15 +135,40 @@ class Solver(ABC):
         self.relaxed_solution = None
         self.vars = None
         self.relaxed_vars = None
+        self.callbacks = []
+        self.build_time = None
+        self.relax_time = None
+        self.trajectory = []
+        self.record = None
+        self.profile = Profile()
+        self.profiler = cProfile.Profile() if self.profile_python else None
 
     def __init__(self, name="model"):
         self.name = name
+        # Gurobi environment and parameters of the models, None uses the default environment
+        self.env = None
+        self.params = {"TimeLimit": 600}
+        # SolutionCache that optimal solutions are looked up in and stored to, None to always solve
+        self.cache = None
+        # Callbacks that stay registered when the model is rebuilt, e.g. to follow the progress of a solve
+        self.observers = []
+        # Solve the LP relaxation on the model itself before the MIP, instead of on a relaxed copy
+        self.shared_relaxation = False
+        # Run cProfile during the phases that run Python code, see phase
+        self.profile_python = False
+        # Verify the solutions after extracting them and fail on violations
+        self.check_solutions = False
+        # Seconds between the trajectory points recorded while the MIP is solved, besides those at new incumbents.
+        # None, the default, only records the final state: the callback slows down the solve it follows.
+        self.record_interval = None
         self.reset()
 
     def get_instance(self) -> Instance:
         return self.instance
 
     def get_model(self, relaxed=False) -> gp.Model:
+        if relaxed and self.shared_relaxation:
+            return self.get_model()
         if relaxed:
             if self.relaxed_model is None:
                 model = self.get_model()
@@ -118,6 +190,8 @@ class Solver(ABC):
             return self.solution
 
     def get_variables(self, relax=False):
+        if relax and self.shared_relaxation:
+            return self.get_variables()
         if relax:
             if self.relaxed_vars is None:
                 self.get_model().update()
@@ -128,19 +202,22 @@ class Solver(ABC):
                 self.vars = SimpleNamespace()
             return self.vars
 
+    # Values of a family of variables in the last solution, in the order the variables were added
+    def get_values(self, var: gp.tupledict, relaxed=False) -> np.ndarray:
+        return np.array(self.get_model(relaxed).getAttr("X", list(var.values())))
+
     def relax_vars(self):
-        relaxed_model = self.get_model(True)
+        # Model.relax() keeps the variable order, so every variable maps to the one at its index
+        relaxed = self.get_model(True).getVars()
         self.relaxed_vars = SimpleNamespace()
         for varname in self.vars.__dict__:
             var = self.vars.__getattribute__(varname)
             if isinstance(var, gp.tupledict):
-                var2 = gp.tupledict()
-                for item in var:
-                    var2[item] = relaxed_model.getVarByName(var[item].VarName)
+                var2 = gp.tupledict(zip(var.keys(), [relaxed[v.index] for v in var.values()]))
                 self.relaxed_vars.__setattr__(varname, var2)
             elif isinstance(var, gp.Var):
-                self.relaxed_vars.__setattr__(varname, relaxed_model.getVarByName(var.VarName))
-            elif isinstance(var, np.float) or isinstance(var, np.int64) or isinstance(var, int):
+                self.relaxed_vars.__setattr__(varname, relaxed[var.index])
+            elif isinstance(var, (float, int, np.floating, np.integer, dict)):
                 self.relaxed_vars.__setattr__(varname, var)
             else:
                 raise Exception(f"Unknown var type {type(var)}")
@@ -157,40 +234,234 @@ class Solver(ABC):
     def extract_solution(self, relaxed) -> Solution:
         pass
 
-    def solve(self, instance: Instance, standard=True, relaxed=True):
+    # Set MIP start values from a feasible solution
+    def set_start(self, solution: Solution):
+        raise Exception(f"{type(self).__name__} does not support warm starts")
+
+    def warm_start(self, start):
+        from evaluator import schedule
+
+        if not isinstance(start, Solution):
+            start = schedule(self.get_instance(), start)
+        self.set_start(start)
+        # Only solutions at least as good as the start are of interest, the objective is in units of time_unit
+        self.get_model().setParam("Cutoff", start.makespan / self.time_unit() + delta)
+
+    # Construction options that change the model or how it is solved, part of the SolutionCache key
+    def options(self):
+        return {}
+
+    # Time a phase of building or solving a model, and the peak memory after it, in self.profile
+    @contextmanager
+    def phase(self, name):
+        profiler = self.profiler if not name.startswith("optimize") else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.profile.add(name, time.perf_counter() - start, peak_rss())
+
+    def get_profile(self) -> Profile:
+        if self.profiler is not None and self.profiler.getstats():
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(30)
+            self.profile.python = out.getvalue()
+        return self.profile
+
+    def extract(self, relaxed) -> Solution:
+        with self.phase("extract_relaxed" if relaxed else "extract"):
+            solution = self.extract_solution(relaxed)
+        if self.check_solutions:
+            with self.phase("verify"):
+                report = solution.verify(relaxed)
+            if not report.valid:
+                raise Exception(f"Invalid {'relaxed ' if relaxed else ''}solution: {report.summary()}")
+        return solution
+
+    # Time represented by one unit of the objective
+    def time_unit(self):
+        return 1
+
+    # Setup time of the LP relaxation, the seconds of the given phases, and the solve of the relaxed model
+    def record_relaxation(self, model, *setup):
+        self.relax_time = self.profile.seconds(*setup)
+        self.profile.relaxation = {'setup': self.relax_time, 'runtime': model.Runtime, 'work': model.Work}
+
+    # Records the progress of the MIP at every new incumbent and every record_interval seconds
+    def trajectory_callback(self):
+        last = [-float('inf')]
+        best = [float('inf')]
+
+        def callback(model, where):
+            if where != GRB.Callback.MIP:
+                return
+            wall = model.cbGet(GRB.Callback.RUNTIME)
+            incumbent = model.cbGet(GRB.Callback.MIP_OBJBST)
+            incumbent = incumbent * self.time_unit() if incumbent < GRB.INFINITY else float('inf')
+            if incumbent < best[0] or wall - last[0] >= self.record_interval:
+                best[0] = min(best[0], incumbent)
+                last[0] = wall
+                self.trajectory.append((wall, model.cbGet(GRB.Callback.WORK), incumbent,
+                                        model.cbGet(GRB.Callback.MIP_OBJBND) * self.time_unit(),
+                                        model.cbGet(GRB.Callback.MIP_NODCNT)))
+        return callback
+
+    # Final state of the last MIP solve, whether or not it was solved to optimality
+    def record_solve(self):
+        model = self.get_model()
+        unit = self.time_unit()
+        incumbent = model.ObjVal * unit if model.SolCount > 0 else float('inf')
+        try:
+            bound = model.ObjBound * unit
+        except gp.GurobiError:
+            # No bound when the solve stopped before the root relaxation
+            bound = -float('inf')
+        self.trajectory.append((model.Runtime, model.Work, incumbent, bound, model.NodeCount))
+        self.record = SolveRecord(
+            status=model.status,
+            incumbent=incumbent,
+            bound=bound,
+            gap=model.MIPGap if model.SolCount > 0 else float('inf'),
+            work=model.Work,
+            nodes=model.NodeCount,
+            trajectory=np.array(self.trajectory, dtype=float).reshape(-1, 5)
+        )
+
+    # Calls every registered callback and observer, or None if there are none
+    def get_callback(self):
+        callbacks = self.callbacks + self.observers
+        if self.record_interval is not None:
+            callbacks = callbacks + [self.trajectory_callback()]
+        if len(callbacks) == 0:
+            return None
+
+        def callback(model, where):
+            for cb in callbacks:
+                cb(model, where)
+        return callback
+
+    def build(self, instance: Instance) -> gp.Model:
         # Reset entirely
         self.reset()
 
         self.instance = instance
 
-        self.model = gp.Model(self.name)
-        self.model.setParam("TimeLimit", 600)
-
-        self.add_variables()
-        self.add_constraints()
+        self.model = gp.Model(self.name, env=self.env)
+        for param, value in self.params.items():
+            self.model.setParam(param, value)
+
+        with self.phase("add_variables"):
+            self.add_variables()
+        with self.phase("add_constraints"):
+            self.add_constraints()
+        with self.phase("update"):
+            self.get_model().update()
+        self.build_time = self.profile.seconds("add_variables", "add_constraints", "update")
+
+        model = self.get_model()
+        self.profile.model.update(vars=model.NumVars, int_vars=model.NumIntVars, constrs=model.NumConstrs,
+                                  nonzeros=model.NumNZs)
+        return self.model
+
+    def solve(self, instance: Instance, standard=True, relaxed=True, start=None):
+        # Only solve what is not in the cache, a warm start is always solved
+        hits = {}
+        if self.cache is not None and start is None:
+            for r, wanted in [(False, standard), (True, relaxed)]:
+                if wanted:
+                    hit = self.cache.get(self, instance, r)
+                    if hit is not None:
+                        hits[r] = hit
+            standard = standard and False not in hits
+            relaxed = relaxed and True not in hits
+            if not standard and not relaxed:
+                self.reset()
+                self.instance = instance
+                self.solution = hits.get(False)
+                self.relaxed_solution = hits.get(True)
+                return
+
+        self.build(instance)
+        self.solution = hits.get(False)
+        self.relaxed_solution = hits.get(True)
+
+        if relaxed and self.shared_relaxation:
+            if len(self.callbacks) > 0:
+                raise Exception("The relaxation cannot share a model whose constraints are added in callbacks")
+            if self.solve_relaxation_in_place(start) is not None:
+                return float('NaN')
+            relaxed = False
 
-        self.get_model().update()
+        # Start from a known schedule, given as a Solution or a server order
+        if start is not None:
+            self.warm_start(start)
 
         # Run the optimizer
         if standard:
-            self.get_model().optimize()
+            with self.phase("optimize"):
+                self.get_model().optimize(self.get_callback())
+            self.record_solve()
             if self.get_model().status != GRB.OPTIMAL:
                 print(f'Warning: Optimizer exited with status {self.get_model().status}')
                 return float('NaN')
-            self.solution = self.extract_solution(False)
+            self.solution = self.extract(False)
             self.solution.solve_time = self.get_model().Work
-            self.solution.method = None
+            self.solution.bound = self.get_model().ObjBound * self.time_unit()
+            if self.cache is not None and start is None:
+                self.cache.put(self, instance, False, self.solution)
 
         if relaxed:
-            model = self.get_model(True)
-
-            model.optimize()
+            with self.phase("relax"):
+                model = self.get_model(True)
+            with self.phase("relax_vars"):
+                self.get_variables(True)
+
+            with self.phase("optimize_relaxed"):
+                model.optimize()
+            self.record_relaxation(model, "relax", "relax_vars")
             if model.status != GRB.OPTIMAL:
                 print(f'Warning: Optimizer exited with status {model.status}')
                 return float('NaN')
-            self.relaxed_solution = self.extract_solution(True)
+            self.relaxed_solution = self.extract(True)
             self.relaxed_solution.solve_time = self.get_model(True).Work
-            self.relaxed_solution.method = None
+            self.relaxed_solution.bound = model.ObjVal * self.time_unit()
+            if self.cache is not None and start is None:
+                self.cache.put(self, instance, True, self.relaxed_solution)
+
+    # Solve the LP relaxation by making every variable of the model continuous, then restore the variable types and
+    # start the MIP from the optimal basis of the relaxation
+    def solve_relaxation_in_place(self, start=None):
+        model = self.get_model()
+        variables = model.getVars()
+        constraints = model.getConstrs()
+
+        with self.phase("relax"):
+            vtypes = model.getAttr("VType", variables)
+            model.setAttr("VType", variables, [GRB.CONTINUOUS] * len(variables))
+
+        with self.phase("optimize_relaxed"):
+            model.optimize()
+        self.record_relaxation(model, "relax")
+        status = model.status
+        if status == GRB.OPTIMAL:
+            self.relaxed_solution = self.extract(True)
+            self.relaxed_solution.solve_time = model.Work
+            self.relaxed_solution.bound = model.ObjVal * self.time_unit()
+            if self.cache is not None and start is None:
+                self.cache.put(self, self.get_instance(), True, self.relaxed_solution)
+            basis = model.getAttr("VBasis", variables), model.getAttr("CBasis", constraints)
+
+        with self.phase("restore"):
+            model.setAttr("VType", variables, vtypes)
+        if status != GRB.OPTIMAL:
+            print(f'Warning: Optimizer exited with status {status}')
+            return status
+        model.setAttr("VBasis", variables, basis[0])
+        model.setAttr("CBasis", constraints, basis[1])
 
     def check_solution(self, assignments, relaxed=False):
         constraints = []
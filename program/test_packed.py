@@ -0,0 +1,51 @@
+import numpy as np
+
+from instance import Instance
+from myinstances import U, read_config_instances
+from packed import PackedDataset, load
+
+configs = [(U(1, 3), U(0, 5), [3, 2]), (1, U(0, 8), [2, 2, 2])]
+
+
+def write_dataset(path, n=3):
+    np.random.seed(0)
+    file = str(path / "data")
+    for i, config in enumerate(configs):
+        for j in range(n):
+            Instance.generate(*config).to_file(f"{file}_{i + 1}_{j + 1}.txt")
+    return file
+
+
+def assert_same(loaded: Instance, original: Instance):
+    assert loaded.encode()['tasks'] == original.encode()['tasks']
+    assert loaded.encode()['machines'] == original.encode()['machines']
+
+
+# Every packed instance reads back as the text file it was packed from
+def test_round_trip(tmp_path):
+    file = write_dataset(tmp_path)
+    dataset = load(file)
+    assert len(dataset) == len(configs)
+    for i in range(len(configs)):
+        instances = dataset.instances(i)
+        assert len(instances) == 3
+        for j, inst in enumerate(instances):
+            assert_same(inst, Instance.from_file(f"{file}_{i + 1}_{j + 1}.txt"))
+
+
+# An edited text file is packed again instead of being shadowed by the old file.pack
+def test_stale_pack(tmp_path):
+    file = write_dataset(tmp_path)
+    sources = load(file).sources
+    Instance.generate(*configs[0]).to_file(f"{file}_1_2.txt")
+    dataset = load(file)
+    assert dataset.sources != sources
+    assert_same(dataset.instances(0)[1], Instance.from_file(f"{file}_1_2.txt"))
+    assert PackedDataset(file + ".pack").sources == dataset.sources
+
+
+def test_first_n(tmp_path):
+    file = write_dataset(tmp_path)
+    sets = read_config_instances("test", configs, file, n=2)
+    assert [len(instance_set.instances) for instance_set in sets] == [2, 2]
+    assert_same(sets[1].instances[1], Instance.from_file(f"{file}_2_2.txt"))
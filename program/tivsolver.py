@@ -1,71 +1,203 @@
 from solver import *
+from evaluator import heads_tails, instance_arrays, predecessors
+from heuristic import HeuristicSolver
+
+
+# Largest time unit in which all setup and processing times are integral
+def time_quantum(instance: Instance):
+    times = np.concatenate((instance.arrays.s, instance.arrays.p))
+    if np.any(times != np.round(times)):
+        return 1
+    return int(np.gcd.reduce(times.astype(np.int64))) or 1
 
 
 class TIVSolver(Solver):
-    def __init__(self):
+    def __init__(self, tighten=True, scale=True, matrix=False):
         super().__init__("tivsolver")
+        # Build the constraints as sparse matrices instead of expression by expression
+        self.matrix = matrix
+        self.tighten = tighten
+        self.scale = scale
+
+    def options(self):
+        return {'tighten': self.tighten, 'scale': self.scale, 'matrix': self.matrix}
+
+    def reset(self):
+        super().reset()
+        self.grid = None
+        self.quantum = 1
+
+    # The instance in units of the time quantum, which the model is built on
+    def get_grid(self) -> Instance:
+        if self.grid is None:
+            instance = self.get_instance()
+            self.quantum = time_quantum(instance) if self.scale else 1
+            self.grid = Instance(
+                tasks=Tasks(instance.arrays.s // self.quantum, instance.arrays.p // self.quantum),
+                machines=[Machine(ordering=m.ordering) for m in instance.machines],
+                uuid=instance.uuid
+            )
+        return self.grid
+
+    def time_unit(self):
+        return self.quantum
+
+    # Grid the model was built on, stored with the solutions: a horizon from the heuristic tightens the LP
+    # relaxation, so its values are not comparable to those on the serial horizon
+    def variant(self):
+        return f"quantum {self.quantum}, {'heuristic' if self.tighten else 'serial'} horizon"
+
+    # Start times every task could take in a schedule of length at most T
+    def start_windows(self, T):
+        instance = self.get_grid()
+        head, tail = heads_tails(instance)
+        s, p, _, _ = instance_arrays(instance)
+        if not self.tighten:
+            head, tail = np.zeros_like(head), np.zeros_like(tail)
+        return {j: range(first, last + 1) for j, (first, last) in
+                enumerate(zip(head.tolist(), (T - tail - s - p).tolist()))}
 
     def add_variables(self):
-        instance = self.get_instance()
+        instance = self.get_grid()
         model = self.get_model()
         variables = self.get_variables()
 
-        variables.T = sum(t.p + t.s for t in instance.tasks)
+        if self.tighten:
+            # Any feasible schedule bounds the optimal makespan
+            variables.T = int(round(HeuristicSolver().solve(instance).makespan))
+        else:
+            variables.T = int(instance.arrays.work.sum())
+        variables.window = self.start_windows(variables.T)
+
+        # Size of the time grid, against the makespan of the serial schedule in the original time unit
+        self.profile.model.update(quantum=self.quantum, time_steps=variables.T,
+                                  serial_makespan=self.get_instance().arrays.work.sum().item())
 
         variables.C_max = model.addVar(name="C_max", vtype=GRB.CONTINUOUS, lb=0)
-        variables.X = model.addVars(len(instance.tasks), int(variables.T), name="X", vtype=GRB.BINARY)
+        variables.X = model.addVars(
+            [(j, t) for j in range(len(instance.tasks)) for t in variables.window[j]], name="X", vtype=GRB.BINARY)
+
+    # Task and time of every X variable, in the order the variables were added
+    def columns(self):
+        window = self.get_variables().window
+        n = len(window)
+        J = np.repeat(np.arange(n), [len(window[j]) for j in range(n)])
+        U = np.concatenate([np.arange(window[j].start, window[j].stop) for j in range(n)])
+        return J, U
+
+    def add_matrix_constraints(self):
+        instance = self.get_grid()
+        model = self.get_model()
+        variables = self.get_variables()
+        n = len(instance.tasks)
+        T = variables.T
+        s, p, _, _ = instance_arrays(instance)
+        s = s.astype(np.int64)
+        pred = predecessors(instance)
+
+        x = [variables.C_max] + list(variables.X.values())
+        J, U = self.columns()
+        X = 1 + np.arange(len(J))
+
+        # Cmax
+        add_matrix_constraints(model, x, np.concatenate((J, np.arange(n))),
+                               np.concatenate((X, np.zeros(n, dtype=np.int64))),
+                               np.concatenate((U + s[J] + p[J], -np.ones(n))),
+                               GRB.LESS_EQUAL, np.zeros(n), name="cmax")
+
+        add_matrix_constraints(model, x, J, X, np.ones(len(J)), GRB.EQUAL, np.ones(n), name="all_scheduled")
+
+        # X[j, u] takes the server during the times u, ..., u + s_j - 1
+        k = np.repeat(np.arange(len(J)), s[J])
+        times = U[k] + np.arange(len(k)) - np.repeat(np.cumsum(s[J]) - s[J], s[J])
+        k, times = k[times < T], times[times < T]
+        shared = np.bincount(times, minlength=T) > 1
+        keep = shared[times]
+        rows = (np.cumsum(shared) - 1)[times[keep]]
+        add_matrix_constraints(model, x, rows, X[k[keep]], np.ones(len(rows)),
+                               GRB.LESS_EQUAL, np.ones(int(shared.sum())), name="single_server")
+
+        # Ordering, one row per task with a machine predecessor
+        later = np.flatnonzero(pred >= 0)
+        row = np.full(n, -1)
+        row[later] = np.arange(len(later))
+        successor = np.full(n, -1)
+        successor[pred[later]] = later
+        ahead = successor[J] >= 0
+        behind = row[J] >= 0
+        add_matrix_constraints(
+            model, x,
+            np.concatenate((row[successor[J[ahead]]], row[J[behind]])),
+            np.concatenate((X[ahead], X[behind])),
+            np.concatenate((U[ahead], -U[behind])),
+            GRB.LESS_EQUAL, -(s[pred[later]] + p[pred[later]]), name="Ordering")
+
+        model.setObjective(variables.C_max)
 
     def add_constraints(self):
-        instance = self.get_instance()
+        if self.matrix:
+            return self.add_matrix_constraints()
+
+        instance = self.get_grid()
         model = self.get_model()
         variables = self.get_variables()
+        tasks = list(instance.tasks)
 
         C_max = variables.C_max
         X = variables.X
         T = variables.T
+        window = variables.window
 
         # Cmax
         model.addConstrs(
-            (gp.quicksum((t + j.s + j.p) * X[j.id, t] for t in range(0, T - j.s - j.p + 1)) <= C_max for j in
-             instance.tasks), name="cmax")
+            (gp.quicksum((t + j.s + j.p) * X[j.id, t] for t in window[j.id]) <= C_max for j in tasks),
+            name="cmax")
 
-        model.addConstrs((gp.quicksum(X[j.id, t] for t in range(0, T - j.s - j.p + 1)) == 1 for j in instance.tasks),
+        model.addConstrs((gp.quicksum(X[j.id, t] for t in window[j.id]) == 1 for j in tasks),
                          name="all_scheduled")
-        model.addConstrs((gp.quicksum(X[j.id, t] for t in range(T - j.s - j.p + 1, T)) == 0 for j in instance.tasks),
-                         name="all_scheduled_2")
+
+        # Tasks whose setup may be running at time t
+        running = {t: [(j.id, s) for j in tasks
+                       for s in range(max(window[j.id].start, t - j.s + 1), min(window[j.id].stop, t + 1))]
+                   for t in range(0, T)}
 
         model.addConstrs((
-            gp.quicksum(
-                X[j.id, s] for j in instance.tasks for s in range(max(0, t - j.s + 1), t + 1)
-            ) <= 1 for t in range(0, T)), name="single_server")
+            gp.quicksum(X[j, s] for j, s in running[t]) <= 1
+            for t in range(0, T) if len(running[t]) > 1), name="single_server")
 
         # Ordering?
         model.addConstrs((
-            gp.quicksum(s * X[instance.machines[mi][i].id, s] for s in range(0, T)) + instance.machines[mi][i].s +
-            instance.machines[mi][i].p <= gp.quicksum(s * X[instance.machines[mi][i + 1].id, s] for s in range(0, T))
+            gp.quicksum(s * X[instance.machines[mi][i].id, s] for s in window[instance.machines[mi][i].id]) +
+            instance.machines[mi][i].s + instance.machines[mi][i].p <=
+            gp.quicksum(s * X[instance.machines[mi][i + 1].id, s] for s in window[instance.machines[mi][i + 1].id])
             for mi in range(len(instance.machines)) for i in range(len(instance.machines[mi]) - 1)
         ), name="Ordering")
 
         model.setObjective(C_max)
 
-    def extract_solution(self, relaxed) -> Solution:
+    def set_start(self, solution: Solution):
         instance = self.get_instance()
-        variables = self.get_variables(relaxed)
+        variables = self.get_variables()
 
-        task_times = {}
-        starttimes_rev = {}
+        variables.C_max.Start = solution.makespan / self.quantum
         for task in instance.tasks:
-            sum = 0
-            for i in range(variables.T):
-                sum = sum + i * variables.X[task.id, i].X
-            starttimes_rev[sum] = task.id
-            task_times[task.id] = (sum, sum + task.s + task.p)
+            start = round(solution.task_times[task.id][0] / self.quantum)
+            for i in variables.window[task.id]:
+                variables.X[task.id, i].Start = 1 if i == start else 0
+
+    def extract_solution(self, relaxed) -> Solution:
+        instance = self.get_instance()
+        variables = self.get_variables(relaxed)
+        s, p, _, _ = instance_arrays(instance)
 
-        order = list(map(lambda i: starttimes_rev[i], sorted(starttimes_rev)))
+        J, U = self.columns()
+        start = np.bincount(J, weights=U * self.get_values(variables.X, relaxed), minlength=len(instance.tasks))
+        start = start * self.quantum
 
         return Solution(
-            server_order=order,
-            task_times=task_times,
-            makespan=variables.C_max.X,
+            server_order=np.argsort(start, kind="stable").tolist(),
+            task_times=dict(enumerate(zip(start.tolist(), (start + s + p).tolist()))),
+            makespan=variables.C_max.X * self.quantum,
+            method=self.variant(),
             instance=instance
         )